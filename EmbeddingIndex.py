@@ -0,0 +1,166 @@
+import numpy as np
+
+# local import
+from StrUtil import StrUtil
+from WidgetUtil import WidgetUtil
+
+
+class EmbeddingIndex:
+    """Word vectors of the widgets in a WidgetDB, to score a source event against all of them at once.
+
+    Each widget gets a slot; each of its attributes is a segment of rows (one row per distinct token) in the
+    matrix of that attribute. Widgets are added and removed incrementally; removed slots are skipped and
+    compacted away once they outnumber the live ones.
+    score() reproduces the w2v_service kernel (w2v_sim_matrix + greedy_match) for every (widget, attribute)
+    segment with a few array operations, then averages the attribute scores like weighted_sim.
+    The vectors come from the w2v model of the 'local' similarity backend (SIM_BACKEND = 'local')
+    """
+    MIN_CAPACITY = 256
+
+    def __init__(self, attrs, use_stopwords=True):
+        self.attrs = attrs
+        self.use_stopwords = use_stopwords
+        self.slots = {}  # widget signature -> slot
+        self.widgets = []  # slot -> widget, None once removed
+        self.num_removed = 0
+        self.lower_ids = {}  # lowercased token -> id, tokens equal up to case score 1.0
+        self.rows = None  # attr -> arrays of the rows, built on first use (not pickled)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['rows'] = None  # rebuilt from the widgets after loading a snapshot
+        return state
+
+    def __len__(self):
+        return len(self.slots)
+
+    @staticmethod
+    def get_model():
+        backend = StrUtil.get_sim_backend()
+        assert hasattr(backend, 'service'), "EmbeddingIndex needs SIM_BACKEND = 'local'"
+        return backend.service.model_w2v
+
+    def add(self, signature, w):
+        if signature in self.slots:
+            self.remove(signature)
+        slot = len(self.widgets)
+        self.slots[signature] = slot
+        self.widgets.append(w)
+        if self.rows is not None:
+            self.add_rows(slot, w)
+
+    def remove(self, signature):
+        slot = self.slots.pop(signature, None)
+        if slot is None:
+            return
+        self.widgets[slot] = None
+        self.num_removed += 1
+        if self.num_removed > max(len(self.slots), EmbeddingIndex.MIN_CAPACITY):
+            self.compact()
+
+    def compact(self):
+        live = [(signature, self.widgets[slot]) for signature, slot in self.slots.items()]
+        self.slots, self.widgets, self.num_removed = {}, [], 0
+        self.rows = None
+        for signature, w in live:
+            self.add(signature, w)
+
+    def build(self):
+        self.rows = {}
+        for attr in self.attrs:
+            self.rows[attr] = {'size': 0, 'max_len': 0, 'vectors': None, 'lower': None, 'in_vocab': None,
+                               'slot': None, 'pos': None}
+        for slot, w in enumerate(self.widgets):
+            if w is not None:
+                self.add_rows(slot, w)
+
+    def add_rows(self, slot, w):
+        tokens = WidgetUtil.get_tokens(w, self.use_stopwords)
+        for attr in self.attrs:
+            words = list(dict.fromkeys(tokens.get(attr, [])))  # like w2v_sent_sim_ids
+            if words:
+                self.append_rows(self.rows[attr], slot, words)
+
+    def get_word_features(self, words, add_lower=True):
+        """Unit vectors (zero if out of vocabulary), in-vocabulary flags and lowercase ids of the words"""
+        model = EmbeddingIndex.get_model()
+        idx = np.array([model.key_to_index.get(t, -1) for t in words])
+        vectors = np.zeros((len(words), model.vector_size))
+        valid = idx >= 0
+        vectors[valid] = model.vectors[idx[valid]] / model.norms[idx[valid]][:, None]
+        if add_lower:
+            lower = [self.lower_ids.setdefault(t.lower(), len(self.lower_ids)) for t in words]
+        else:
+            lower = [self.lower_ids.get(t.lower(), -1) for t in words]
+        return vectors, valid, np.array(lower)
+
+    def append_rows(self, rows, slot, words):
+        vectors, in_vocab, lower = self.get_word_features(words)
+        start, end = rows['size'], rows['size'] + len(words)
+        if rows['vectors'] is None or end > len(rows['vectors']):
+            capacity = max(EmbeddingIndex.MIN_CAPACITY, 2 * end)
+            for key, width in [('vectors', vectors.shape[1]), ('lower', 0), ('in_vocab', 0), ('slot', 0), ('pos', 0)]:
+                shape = (capacity, width) if width else (capacity,)
+                dtype = bool if key == 'in_vocab' else (float if key == 'vectors' else int)
+                grown = np.zeros(shape, dtype=dtype)
+                if rows[key] is not None:
+                    grown[:start] = rows[key][:start]
+                rows[key] = grown
+        rows['vectors'][start:end] = vectors
+        rows['lower'][start:end] = lower
+        rows['in_vocab'][start:end] = in_vocab
+        rows['slot'][start:end] = slot
+        rows['pos'][start:end] = np.arange(len(words))
+        rows['size'] = end
+        rows['max_len'] = max(rows['max_len'], len(words))
+
+    def score(self, src_tokens):
+        """weighted_sim of every widget against a source event given by its attribute tokens
+        (WidgetUtil.get_tokens): a dict from widget signature to the score, None if there is no score
+        """
+        if self.rows is None:
+            self.build()
+        num_slots = len(self.widgets)
+        total = np.zeros(num_slots)
+        count = np.zeros(num_slots)
+        for attr in self.attrs:
+            sims = self.score_attr(self.rows[attr], src_tokens.get(attr, []), num_slots)
+            if sims is None:
+                continue
+            scored = ~np.isnan(sims) & (sims != 0)  # falsy scores are dropped, as by the similarity backends
+            total[scored] += sims[scored]
+            count[scored] += 1
+        scores = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        return {signature: (None if np.isnan(scores[slot]) else float(scores[slot]))
+                for signature, slot in self.slots.items()}
+
+    def score_attr(self, rows, words, num_slots):
+        """Sentence similarity of the words to every segment of the attribute, NaN for the segments without score"""
+        words = list(dict.fromkeys(words))
+        size, max_len = rows['size'], rows['max_len']
+        if not words or size == 0:
+            return None
+        vectors, in_vocab, lower = self.get_word_features(words, add_lower=False)
+        # the word similarity matrix of w2v_sim_matrix, against all the rows at once
+        dist = np.sqrt(np.clip(2 - 2 * (vectors @ rows['vectors'][:size].T), 0, None))
+        sims = np.where(in_vocab[:, None] & rows['in_vocab'][None, :size], 1 / (1 + dist), -np.inf)
+        sims = np.where(lower[:, None] == rows['lower'][None, :size], 1.0, sims)
+        # one |words| x max_len matrix per segment, padded with -inf; then greedy_match on all of them together
+        num_words = len(words)
+        matrices = np.full((num_slots, num_words, max_len), -np.inf)
+        matrices[rows['slot'][:size], :, rows['pos'][:size]] = sims.T
+        flat = matrices.reshape(num_slots, num_words * max_len)
+        all_slots = np.arange(num_slots)
+        total = np.zeros(num_slots)
+        count = np.zeros(num_slots)
+        for _ in range(min(num_words, max_len)):
+            best = np.argmax(flat, axis=1)
+            best_sims = flat[all_slots, best]
+            matched = best_sims > -np.inf
+            if not matched.any():
+                break
+            total[matched] += best_sims[matched]
+            count[matched] += 1
+            matrices[all_slots, best // max_len, :] = -np.inf
+            matrices[all_slots, :, best % max_len] = -np.inf
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
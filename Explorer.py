@@ -1,6 +1,6 @@
 import time
-from copy import deepcopy
 import sys
+import atexit
 import traceback
 import os
 from statistics import mean
@@ -14,17 +14,20 @@ from Util import Util
 from StrUtil import StrUtil
 from Configuration import Configuration
 from Runner import Runner
+from Widget import Widget
 from WidgetUtil import WidgetUtil
+from WidgetDB import WidgetDB
+from EmbeddingIndex import EmbeddingIndex
 from CallGraphParser import CallGraphParser
 from ResourceParser import ResourceParser
-from const import SA_INFO_FOLDER, SNAPSHOT_FOLDER
+from const import SA_INFO_FOLDER, SNAPSHOT_FOLDER, SIM_VECTORIZED, INCREMENTAL_EXECUTION
 
 
 class Explorer:
     def __init__(self, config_id, appium_port='4723', udid=None):
         self.config = Configuration(config_id)
         self.runner = Runner(self.config.pkg_to, self.config.act_to, self.config.no_reset, appium_port, udid)
-        self.src_events = Util.load_events(self.config.id, 'base_from')
+        self.src_events = [WidgetUtil.add_tokens(Widget.from_dict(e)) for e in Util.load_events(self.config.id, 'base_from')]
         self.tid = self.config.id
         self.current_src_index = 0
         self.tgt_events = []
@@ -40,9 +43,11 @@ class Explorer:
         self.idx_src_to_tgt = {}
         self.skipped_match = defaultdict(list)
         self.consider_naf_only_widget = False
+        # by execute_target_events; restores: prefix snapshots loaded instead of a reset (see PrefixSnapshotCache)
+        self.exec_stats = {'resets': 0, 'restores': 0, 'resets_saved': 0, 'events_skipped': 0}
 
     def generate_widget_db(self):
-        db = {}
+        db = WidgetDB(EmbeddingIndex(WidgetUtil.SIM_ATTRS, self.config.use_stopwords) if SIM_VECTORIZED else None)
         for w in self.rp.get_widgets():
             if w['activity']:
                 # the signature here has no 'clickable' and 'password', bcuz it's from static info
@@ -52,9 +57,8 @@ class Explorer:
 
     def mutate_src_action(self, mutant):
         # e.g., mutant = {'long_press': 'swipe_right', 'swipe_right': 'long_press'}
-        for e in self.src_events:
-            if e['action'][0] in mutant:
-                e['action'][0] = mutant[e['action'][0]]
+        self.src_events = [e.set('action', [mutant[e['action'][0]]] + list(e['action'][1:]))
+                           if e['action'][0] in mutant else e for e in self.src_events]
 
     def run(self):
         # todo: or exceed a time limit
@@ -94,11 +98,10 @@ class Explorer:
                     if prev_src_event['event_type'] == 'oracle' and src_event['event_type'] == 'gui' \
                             and WidgetUtil.is_equal(prev_src_event, src_event) \
                             and self.tgt_events[-1]['class'] != 'EMPTY_EVENT':
-                        tgt_event = deepcopy(self.tgt_events[-1])
-                        if 'stepping_events' in tgt_event:
-                            tgt_event['stepping_events'] = []
-                        tgt_event['event_type'] = 'gui'
-                        tgt_event['action'] = deepcopy(src_event['action'])
+                        changes = {'event_type': 'gui', 'action': src_event['action']}
+                        if 'stepping_events' in self.tgt_events[-1]:
+                            changes['stepping_events'] = []
+                        tgt_event = self.tgt_events[-1].update(changes)
                         if self.check_skipped(tgt_event):  # don't copy previous src_event if it should be skipped
                             tgt_event = None
                         # todo: remember if the tgt_action is propagated the previous oracle;
@@ -107,12 +110,12 @@ class Explorer:
                 if src_event['event_type'] == 'SYS_EVENT':
                     # e.g., {"class": "SYS_EVENT","action": ["KEY_BACK"], "event_type":  "SYS_EVENT"}
                     # self.is_rerun_required = False
-                    tgt_event = deepcopy(src_event)
+                    tgt_event = src_event
 
                 backtrack = False
                 if not tgt_event:
                     try:
-                        dom, pkg, act = self.execute_target_events([])
+                        state = self.execute_target_events([])
                     except:  # selenium.common.exceptions.NoSuchElementException
                         # a23-a21-b21, a24-a21-b21: selected an EditText which is not editable
                         print(f'Backtrack to the previous step due to an exception in execution.')
@@ -123,10 +126,10 @@ class Explorer:
                             self.tgt_events = []
                         else:
                             self.tgt_events = self.tgt_events[:self.idx_src_to_tgt[self.current_src_index - 1] + 1]
-                        self.invalid_events[self.current_src_index].append(deepcopy(invalid_event))
+                        self.invalid_events[self.current_src_index].append(invalid_event)
                         continue
 
-                    self.cache_seen_widgets(dom, pkg, act)
+                    self.cache_seen_widgets(state)
 
                     w_candidates = []
                     num_to_check = 10
@@ -134,19 +137,21 @@ class Explorer:
                         if not self.nearest_button_to_text:
                             tgt_event = Explorer.generate_empty_event(src_event['event_type'])
                         else:
-                            w_candidates = WidgetUtil.most_similar(self.nearest_button_to_text, self.widget_db.values(),
+                            num_to_check = 1  # we know the button exists, so no need to seek other similar ones
+                            w_candidates = WidgetUtil.most_similar(self.nearest_button_to_text, self.widget_db,
                                                                    self.config.use_stopwords,
                                                                    self.config.expand_btn_to_text,
-                                                                   self.config.cross_check)
-                            num_to_check = 1  # we know the button exists, so no need to seek other similar ones
+                                                                   self.config.cross_check, num_to_check,
+                                                                   state.get_signature())
                     else:
-                        w_candidates = WidgetUtil.most_similar(src_event, self.widget_db.values(),
+                        w_candidates = WidgetUtil.most_similar(src_event, self.widget_db,
                                                                self.config.use_stopwords,
                                                                self.config.expand_btn_to_text,
-                                                               self.config.cross_check)
+                                                               self.config.cross_check, num_to_check,
+                                                               state.get_signature())
 
                     # if w_candidates:
-                    #     w_candidates = self.decay_by_distance(w_candidates, pkg, act)
+                    #     w_candidates = self.decay_by_distance(w_candidates, state.pkg, state.act)
                     for i, (w, _) in enumerate(w_candidates[:num_to_check]):
                         # encode-decode: for some weird chars in a1 apps
                         print(f'({i+1}/{num_to_check}) Validating Similar w: {w}'.encode("utf-8").decode("utf-8"))
@@ -173,7 +178,7 @@ class Explorer:
                                 print('Skip the widget without the attribute that the action is waiting for')
                                 continue
                         try:
-                            match = self.check_reachability(w, pkg, act)
+                            match = self.check_reachability(w, state.pkg, state.act)
                         except Exception as excep:
                             print(excep)
                             traceback.print_exc()
@@ -195,7 +200,7 @@ class Explorer:
                                         print(f'Duplicated match. Backtrack to src_idx: {src_idx} to find another match')
                                         backtrack = True
                                         self.current_src_index = src_idx
-                                        self.skipped_match[src_idx].append(deepcopy(self.tgt_events[tgt_idx]))
+                                        self.skipped_match[src_idx].append(self.tgt_events[tgt_idx])
                                         # pop tgt_events
                                         if src_idx == 0:
                                             self.tgt_events = []
@@ -206,11 +211,11 @@ class Explorer:
                                 self.widget_db.pop(WidgetUtil.get_widget_signature(w), None)
                             if src_event['action'][0] == 'wait_until_text_invisible':
                                 if self.runner.check_text_invisible(src_event):
-                                    tgt_event = self.generate_event(match, deepcopy(src_event['action']))
+                                    tgt_event = self.generate_event(match, src_event['action'])
                                 else:
                                     tgt_event = Explorer.generate_empty_event(src_event['event_type'])
                             else:
-                                tgt_event = self.generate_event(match, deepcopy(src_event['action']))
+                                tgt_event = self.generate_event(match, src_event['action'])
                             break
                 if backtrack:
                     continue
@@ -260,10 +265,7 @@ class Explorer:
            and update ATG and widget_db by systematic exploration
         """
         self.runner.perform_actions(tgt_events, reset=True)  # reset app
-        all_widgets = WidgetUtil.find_all_widgets(self.runner.get_page_source(),
-                                                  self.runner.get_current_package(),
-                                                  self.runner.get_current_activity(),
-                                                  self.config.pkg_to)
+        all_widgets = WidgetUtil.find_all_widgets(self.runner.get_gui_state(), self.config.pkg_to)
         btn_widgets = []
         for w in all_widgets:
             if w['class'] in ['android.widget.Button', 'android.widget.ImageButton', 'android.widget.TextView']:
@@ -273,14 +275,12 @@ class Explorer:
                     btn_widgets.append(w)
         for btn_w in btn_widgets:
             self.runner.perform_actions(tgt_events, reset=True)
-            btn_w['action'] = ['click']
+            btn_w = btn_w.set('action', ['click'])
             self.runner.perform_actions([btn_w], reset=False, cgp=self.cgp)
-            self.cache_seen_widgets(self.runner.get_page_source(),
-                                    self.runner.get_current_package(),
-                                    self.runner.get_current_activity())
+            self.cache_seen_widgets(self.runner.get_gui_state())
 
-    def cache_seen_widgets(self, dom, pkg, act):
-        current_widgets = WidgetUtil.find_all_widgets(dom, pkg, act, self.config.pkg_to)
+    def cache_seen_widgets(self, state):
+        current_widgets = WidgetUtil.find_all_widgets(state, self.config.pkg_to)
         # print('** before:', self.widget_db)
         for w in current_widgets:
             w_signature = WidgetUtil.get_widget_signature(w)
@@ -320,15 +320,25 @@ class Explorer:
         require_wait = src_event['action'][0].startswith('wait_until')
         # require_wait = True
         # if self.is_rerun_required:
-        self.runner.perform_actions(self.tgt_events, require_wait, reset=True, cgp=self.cgp)
+        done = self.runner.get_resume_point(self.tgt_events) if INCREMENTAL_EXECUTION else None
+        if done is None:
+            if self.runner.perform_actions(self.tgt_events, require_wait, reset=True, cgp=self.cgp):
+                self.exec_stats['restores'] += 1
+            else:
+                self.exec_stats['resets'] += 1
+        else:  # the device has run the first target events and is still on the screen they led to
+            self.exec_stats['resets_saved'] += 1
+            self.exec_stats['events_skipped'] += done
+            self.runner.perform_actions(self.tgt_events[done:], require_wait, reset=False, cgp=self.cgp)
         # elif not self.is_rerun_required and self.tgt_events:
         #     # no reset and rerun, just execute the last matched action
         #     self.runner.perform_actions([self.tgt_events[-1]], require_wait, reset=False, cgp=self.cgp)
         self.runner.perform_actions(stepping_events, require_wait, reset=False, cgp=self.cgp)
-        return self.runner.get_page_source(), self.runner.get_current_package(), self.runner.get_current_activity()
+        return self.runner.get_gui_state()
 
     @staticmethod
     def generate_event(w, actions=None):
+        actions = list(actions)  # a copy of the source actions, adapted below
         # if the action is wait_until_presence, change the content-desc/text/id to that of target app
         # e.g., ['wait_until_element_presence', 10, 'xpath', '//*[@content-desc="Open Menu"]']
         if actions[0] == 'wait_until_element_presence':
@@ -346,16 +356,15 @@ class Explorer:
                 actions[3] = pre + post
             elif actions[2] == 'id':
                 actions[3] = w['resource-id']
-        w['action'] = actions
-        return w
+        return w.set('action', actions)
 
     @staticmethod
     def generate_empty_event(event_type):
-        return {"class": "EMPTY_EVENT", 'score': 0, 'event_type': event_type}
+        return Widget.from_dict({"class": "EMPTY_EVENT", 'score': 0, 'event_type': event_type})
 
     def check_reachability(self, w, current_pkg, current_act):
         # print(f'Validating Similar w: {w}')
-        # dom, pkg, act = self.execute_target_events([])
+        # state = self.execute_target_events([])
         act_from = current_pkg + current_act
         act_to = w['package'] + w['activity']
         potential_paths = self.cgp.get_paths_between_activities(act_from, act_to, self.consider_naf_only_widget)
@@ -389,7 +398,7 @@ class Explorer:
                 return None
 
         # start follow the path to w_target
-        _, __, ___ = self.execute_target_events([])
+        state = self.execute_target_events([])
         stepping = []
         for i, hop in enumerate(ppath):
             if '(' in hop:  # a GUI event
@@ -402,10 +411,10 @@ class Explorer:
                     kv = [kvp.split('=') for kvp in kv_pairs]
                     criteria = {k: v for k, v in kv}
                     print('D@criteria:', criteria)
-                    w_stepping = WidgetUtil.locate_widget(self.runner.get_page_source(), criteria)
+                    w_stepping = WidgetUtil.locate_widget(state, criteria)
                 else:  # from static analysis
                     w_name = self.rp.get_wName_from_oId(w_id)
-                    w_stepping = WidgetUtil.locate_widget(self.runner.get_page_source(), {'resource-id': w_name})
+                    w_stepping = WidgetUtil.locate_widget(state, {'resource-id': w_name})
                 if not w_stepping:
                     # add current path prefix to invalide path
                     is_existed = False
@@ -415,17 +424,14 @@ class Explorer:
                     if not is_existed:
                         invalid_paths.append([h for h in ppath[:i+1]])
                     return None
-                w_stepping['action'] = [action]
-                w_stepping['activity'] = self.runner.get_current_activity()
-                w_stepping['package'] = self.runner.get_current_package()
-                w_stepping['event_type'] = 'stepping'
+                w_stepping = w_stepping.update({'action': [action], 'activity': state.act, 'package': state.pkg,
+                                                'event_type': 'stepping'})
                 stepping.append(w_stepping)
-                act_from = self.runner.get_current_package() + self.runner.get_current_activity()
+                act_from = state.pkg + state.act
                 self.runner.perform_actions([stepping[-1]], require_wait=False, reset=False, cgp=self.cgp)
-                self.cache_seen_widgets(self.runner.get_page_source(),
-                                        self.runner.get_current_package(),
-                                        self.runner.get_current_activity())
-                act_to = self.runner.get_current_package() + self.runner.get_current_activity()
+                state = self.runner.get_gui_state()  # the screen after the hop
+                self.cache_seen_widgets(state)
+                act_to = state.pkg + state.act
                 self.cgp.add_edge(act_from, act_to, w_stepping)
 
         # check if the target widget exists
@@ -442,27 +448,23 @@ class Explorer:
             # for the case of matching to the only one email field
             if StrUtil.is_contain_email(self.src_events[self.current_src_index]['action'][1]):
                 criteria['text'] = self.runner.databank.get_temp_email(renew=False)
-        w_tgt = WidgetUtil.locate_widget(self.runner.get_page_source(), criteria)
+        w_tgt = WidgetUtil.locate_widget(state, criteria)
         if not w_tgt:
             return None
         else:
             src_event = self.src_events[self.current_src_index]
-            w_tgt['stepping_events'] = stepping
-            w_tgt['package'] = self.runner.get_current_package()
-            w_tgt['activity'] = self.runner.get_current_activity()
-            w_tgt['event_type'] = src_event['event_type']
-            w_tgt['score'] = WidgetUtil.weighted_sim(w_tgt, src_event)
+            w_tgt = w_tgt.update({'stepping_events': stepping, 'package': state.pkg, 'activity': state.act,
+                                  'event_type': src_event['event_type']})
+            w_tgt = w_tgt.set('score', WidgetUtil.weighted_sim(w_tgt, src_event, self.config.use_stopwords))
             if src_event['action'][0] == 'wait_until_text_invisible':
                 # here, w_tgt is the nearest button to the text. Convert it to the oracle event
-                for k in w_tgt.keys():
-                    if k not in ['stepping_events', 'package', 'activity', 'event_type', 'score']:
-                        w_tgt[k] = ''
+                w_tgt = w_tgt.update({k: '' for k in w_tgt.keys()
+                                      if k not in ['stepping_events', 'package', 'activity', 'event_type', 'score']})
 
             if src_event['action'][0] == 'wait_until_text_presence':
                 # cache the closest button on the current screen for possible text_invisible oracle in the future
-                self.nearest_button_to_text = WidgetUtil.get_nearest_button(self.runner.get_page_source(), w_tgt)
-                self.nearest_button_to_text['activity'] = w_tgt['package']
-                self.nearest_button_to_text['package'] = w_tgt['activity']
+                self.nearest_button_to_text = WidgetUtil.get_nearest_button(state, w_tgt).update(
+                    {'activity': w_tgt['package'], 'package': w_tgt['activity']})
 
             return w_tgt
 
@@ -493,8 +495,7 @@ class Explorer:
         for i, e in enumerate(self.tgt_events):
             if e['class'] != 'android.widget.EditText' or 'send_keys' not in e['action'][0]:
                 continue
-            e_tgt_new_text = deepcopy(e)
-            e_tgt_new_text['text'] = e_tgt_new_text['action'][1]
+            e_tgt_new_text = e.set('text', e['action'][1])
             # todo: ensure that e and match are on the same screen
             if WidgetUtil.is_equal(match, e) or WidgetUtil.is_equal(match, e_tgt_new_text):
                 tgt_idx = i
@@ -512,8 +513,7 @@ class Explorer:
 
     def check_skipped(self, match):
         for skipped in self.skipped_match[self.current_src_index]:
-            skipped_new_text = deepcopy(skipped)
-            skipped_new_text['text'] = skipped_new_text['action'][1]
+            skipped_new_text = skipped.set('text', skipped['action'][1])
             if WidgetUtil.is_equal(match, skipped) or WidgetUtil.is_equal(match, skipped_new_text):
                 return True
         return False
@@ -531,10 +531,8 @@ class Explorer:
             if self.is_for_email_or_pwd(src_e1, src_e2):
                 return True
             else:
-                w1 = deepcopy(src_e1)
-                w1['text'] = ''
-                w2 = deepcopy(src_e2)
-                w2['text'] = ''
+                w1 = src_e1.set('text', '')
+                w2 = src_e2.set('text', '')
                 return WidgetUtil.is_equal(w1, w2)
         else:
             return True
@@ -619,6 +617,9 @@ if __name__ == '__main__':
     else:
         explorer = Explorer(config_id, appium_port, udid)
 
+    if explorer.runner.snapshots is not None:
+        # delete the prefix snapshots (GBs in the AVD folder) at exit, also after an error, e.g., of appium
+        atexit.register(explorer.runner.snapshots.clear)
     t_start = time.time()
     # explorer.mutate_src_action({'long_press': 'swipe_right', 'swipe_right': 'long_press'})
     is_done, failed_step = explorer.run()
@@ -631,11 +632,16 @@ if __name__ == '__main__':
         for a in results:
             print(a)
         print(f'Transfer time in sec: {time.time() - t_start}')
+        print(f'Similarity queries: {StrUtil.get_sim_stats()}')
+        print(f'GUI state cache: {WidgetUtil.state_to_widgets.stats()}, rankings: {WidgetUtil.ranking_stats}')
+        print(f'UI waits: {explorer.runner.wait_stats}, executions: {explorer.exec_stats}')
+        if explorer.runner.snapshots is not None:
+            print(f'Prefix snapshots: {explorer.runner.snapshots.get_stats()}')
         # input('wait clear')
         print(f'Start testing learned actions')
         t_start = time.time()
         try:
-            explorer.runner.perform_actions(results)
+            explorer.runner.perform_actions(results, use_snapshots=False)
             print(f'Testing time in sec: {time.time() - t_start}')
         except Exception as excep:
             print(f'Error when validating learned actions\n{excep}')
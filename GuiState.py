@@ -0,0 +1,98 @@
+import re
+import hashlib
+from collections import defaultdict, deque
+from lxml import etree
+
+
+class GuiState:
+    """A GUI state of the app under test: the xml hierarchy (page source) parsed once,
+    together with the package/activity it was captured from
+    """
+    PARSER = etree.XMLParser(recover=True, huge_tree=True)
+    # character references to UTF-16 surrogates (U+D800-DFFF), as emoji are dumped, which lxml cannot decode
+    SURROGATE_REF = re.compile(r'&#(?:5529[6-9]|55[3-9]\d\d|56\d\d\d|57[0-2]\d\d|573[0-3]\d|5734[0-3]|'
+                               r'[xX][dD][89a-fA-F][0-9a-fA-F]{2});')
+    XPATHS = {}  # (attribute, match) names of find criteria -> compiled XPath
+
+    def __init__(self, dom, pkg, act):
+        self.dom = dom
+        self.pkg = pkg
+        self.act = act
+        self.root = GuiState.parse(dom)
+        self.signature = None
+        self.class_to_elements = None
+        self.neighbors = {}  # (class, resource-id) -> ATM neighbor refs, see WidgetUtil.atm_neighbor
+
+    @classmethod
+    def parse(cls, dom):
+        dom = cls.SURROGATE_REF.sub('', dom)  # remove emoji (halves of surrogate pairs), keep e.g. '&#10;'
+        return etree.fromstring(dom.encode('utf-8'), cls.PARSER)
+
+    def get_signature(self, canonical=False):
+        """Get the signature for the GUI state by the package/activity name and the xml hierarchy
+        The hierarchy part is a hash of the number of children of each node in breadth first order,
+        which determines the tree structure. canonical=True gives the readable (long) form for debugging
+        """
+        if canonical:
+            return self.get_canonical_signature()
+        if self.signature is None:
+            digest = hashlib.sha1()
+            queue = deque([self.root])
+            while queue:
+                node = queue.popleft()
+                digest.update(b'%d,' % len(node))
+                queue.extend(node)
+            self.signature = '!'.join([self.pkg, self.act, digest.hexdigest()])
+        return self.signature
+
+    def get_canonical_signature(self):
+        """Breadth first traversal for the non-leaf/leaf nodes and their cumulative index sequences"""
+        queue = deque([(self.root, '0')])
+        layouts = []
+        executable_leaves = []
+        while queue:
+            node, idx = queue.popleft()
+            if len(node):  # the node has child(ren)
+                layouts.append(idx)
+                for i, child in enumerate(node):
+                    queue.append((child, idx + '-' + str(i)))
+            else:  # a leaf node
+                executable_leaves.append(idx)
+        sign = [self.pkg, self.act, '+'.join(layouts), '+'.join(executable_leaves)]
+        return '!'.join(sign)
+
+    def find_all(self, class_name):
+        """All elements whose class attribute is class_name, in document order"""
+        if self.class_to_elements is None:
+            self.class_to_elements = defaultdict(list)
+            for e in self.root.iter(tag=etree.Element):
+                self.class_to_elements[e.get('class')].append(e)
+        return self.class_to_elements.get(class_name, [])
+
+    def find(self, criteria):
+        """The first element (in document order) whose attributes match all the criteria: a dict from the attribute
+        name to (match, value), where match is 'equals', 'contains' or 'ends-with' and the value is taken literally
+        """
+        names = tuple((k, match) for k, (match, _) in criteria.items())
+        values = {f'v{i}': v for i, (_, v) in enumerate(criteria.values())}
+        found = GuiState.get_xpath(names)(self.root, **values)
+        return found[0] if found else None
+
+    @classmethod
+    def get_xpath(cls, names):
+        """The XPath for the criteria on the given (attribute, match) names, compiled once; the values are
+        passed as the XPath variables $v0, $v1, ... so they need no escaping
+        """
+        if names not in cls.XPATHS:
+            conds = []
+            for i, (k, match) in enumerate(names):
+                if match == 'equals':
+                    conds.append(f'@{k}=$v{i}')
+                elif match == 'contains':
+                    conds.append(f'@{k} and contains(@{k}, $v{i})')
+                elif match == 'ends-with':  # there is no ends-with() in XPath 1.0
+                    conds.append(f'@{k} and substring(@{k}, string-length(@{k}) - string-length($v{i}) + 1)=$v{i}')
+                else:
+                    raise ValueError(f'Unknown match: {match}')
+            cls.XPATHS[names] = etree.XPath(f"(//*[{' and '.join(conds)}])[1]")
+        return cls.XPATHS[names]
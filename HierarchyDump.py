@@ -0,0 +1,92 @@
+import re
+import time
+import queue
+import threading
+import subprocess
+from lxml import etree
+
+# local import
+from GuiState import GuiState
+from const import PAGE_SOURCE_DUMP_TIMEOUT
+
+
+class AdbHierarchyDump:
+    """Page sources by `uiautomator dump` over one adb shell kept open, instead of appium's driver.page_source.
+    The dump is normalized to the schema of appium (UiAutomator2): each <node> is named after its class, and the
+    root gets the index/class of appium's <hierarchy>. The attributes are the same (text, resource-id, class,
+    content-desc, clickable, password, bounds, ...).
+    The output of the shell is read by a thread, so that a stalled dump times out (PAGE_SOURCE_DUMP_TIMEOUT): the shell
+    is killed and restarted on the next dump
+    """
+    DUMP_PATH = '/sdcard/window_dump.xml'
+    END_MARKER = '__HIERARCHY_DUMP_END__'
+
+    def __init__(self, udid=None):
+        self.adb = ['adb', '-s', udid] if udid else ['adb']
+        self.shell = None
+        self.lines = None  # lines of output of the shell, None at its end
+
+    def start(self):
+        self.shell = subprocess.Popen(self.adb + ['shell'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.DEVNULL)
+        self.lines = queue.Queue()
+        threading.Thread(target=AdbHierarchyDump.read_lines, args=(self.shell.stdout, self.lines), daemon=True).start()
+
+    @staticmethod
+    def read_lines(stdout, lines):
+        for line in iter(stdout.readline, b''):
+            lines.put(line)
+        lines.put(None)
+
+    def close(self):
+        if self.shell is not None:
+            self.shell.stdin.close()
+            self.shell.wait()
+            self.shell = None
+
+    def kill(self):
+        if self.shell is not None:
+            self.shell.kill()
+            self.shell.wait()
+            self.shell = None
+
+    def get_page_source(self):
+        """The normalized page source, or None if the dump failed or timed out (e.g., uiautomator is busy)"""
+        if self.shell is None or self.shell.poll() is not None:
+            self.start()
+        cmd = f'uiautomator dump {AdbHierarchyDump.DUMP_PATH} >/dev/null 2>&1; cat {AdbHierarchyDump.DUMP_PATH}; ' \
+              f'rm -f {AdbHierarchyDump.DUMP_PATH}; echo; echo {AdbHierarchyDump.END_MARKER}\n'
+        deadline = time.time() + PAGE_SOURCE_DUMP_TIMEOUT
+        lines = []
+        try:
+            self.shell.stdin.write(cmd.encode('utf-8'))
+            self.shell.stdin.flush()
+            while True:
+                line = self.lines.get(timeout=max(0.0, deadline - time.time()))
+                if line is None:  # the shell died, e.g., the device was disconnected
+                    raise OSError('adb shell exited')
+                line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                if line == AdbHierarchyDump.END_MARKER:
+                    break
+                lines.append(line)
+        except queue.Empty:
+            print(f'uiautomator dump timed out after {PAGE_SOURCE_DUMP_TIMEOUT}s, restarting the adb shell')
+            self.kill()
+            return None
+        except OSError:  # restart the shell next time
+            self.kill()
+            return None
+        dump = '\n'.join(lines).strip()
+        if not dump.startswith('<?xml'):
+            return None
+        return AdbHierarchyDump.normalize(dump)
+
+    @staticmethod
+    def normalize(dump):
+        root = GuiState.parse(dump)
+        root.set('index', '0')
+        root.set('class', 'hierarchy')
+        for node in root.iter('node'):
+            # as appium does, characters not allowed in xml names (e.g., '$' of inner classes) become '_'
+            node.tag = re.sub(r'[^\w.\-]', '_', node.get('class') or '') or 'android.view.View'
+        return etree.tostring(root, encoding='unicode')
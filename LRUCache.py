@@ -0,0 +1,104 @@
+import sys
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry when full, and counts hits and misses
+    If max_bytes is given, entries are also evicted while their total size (by sizeof, measured on put; see add_bytes) exceeds it.
+    on_evict(key, value) is called for each evicted entry, e.g., to release what it refers to
+    """
+
+    def __init__(self, max_entries, max_bytes=None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or LRUCache.deep_sizeof
+        self.on_evict = on_evict
+        self.data = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.hits += 1
+            self.data.move_to_end(key)
+            return self.data[key]
+        self.misses += 1
+        return default
+
+    def peek(self, key, default=None):
+        """The value of key, without counting a hit or miss nor making it recently used"""
+        return self.data.get(key, default)
+
+    def put(self, key, value):
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.bytes -= self.sizes.pop(key, 0)
+        self.data[key] = value
+        if self.max_bytes is not None:
+            self.sizes[key] = self.sizeof(value)
+            self.bytes += self.sizes[key]
+        self.evict()
+
+    def add_bytes(self, key, n):
+        """Account n more bytes (fewer if negative) to the entry of key, e.g., after its value grew in place, without
+        measuring the whole value again. The entry becomes the most recently used
+        """
+        if key not in self.data or self.max_bytes is None:
+            return
+        self.data.move_to_end(key)
+        self.sizes[key] = self.sizes.get(key, 0) + n
+        self.bytes += n
+        self.evict()
+
+    def evict(self):
+        # the most recently used entry is kept even if it alone is over max_bytes
+        while len(self.data) > self.max_entries or \
+                (self.max_bytes is not None and self.bytes > self.max_bytes and len(self.data) > 1):
+            old_key, old_value = self.data.popitem(last=False)
+            self.bytes -= self.sizes.pop(old_key, 0)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def clear(self):
+        self.data.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.data), 'max_entries': self.max_entries, 'bytes': self.bytes,
+                'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'hit_ratio': self.hits / lookups if lookups else 0.0}
+
+    @staticmethod
+    def deep_sizeof(obj):
+        """Approximate size in bytes of obj and the dicts/lists/tuples/sets and slotted objects (e.g., Widget)
+        it contains; shared objects count once
+        """
+        seen = set()
+        size = 0
+        stack = [obj]
+        while stack:
+            o = stack.pop()
+            if id(o) in seen:
+                continue
+            seen.add(id(o))
+            size += sys.getsizeof(o)
+            if isinstance(o, dict):
+                stack.extend(o.keys())
+                stack.extend(o.values())
+            elif isinstance(o, (list, tuple, set, frozenset)):
+                stack.extend(o)
+            elif hasattr(type(o), '__slots__'):
+                stack.extend(getattr(o, s) for s in type(o).__slots__ if hasattr(o, s))
+        return size
@@ -4,6 +4,9 @@ import lxml.etree
 from bs4 import BeautifulSoup
 from lxml.etree import tostring
 import csv
+# local import
+from Widget import Widget
+from WidgetUtil import WidgetUtil
 
 
 class ResourceParser:
@@ -171,7 +174,7 @@ class ResourceParser:
                             if a not in d:
                                 d[a] = ""
                         # if d['name'] or d['oId']:
-                        widgets.append(d)
+                        widgets.append(WidgetUtil.add_tokens(Widget.from_dict(d)))
                         # print(d)
         return widgets
 
@@ -13,15 +13,31 @@ import subprocess
 from Databank import Databank
 from misc import teardown_mail
 from StrUtil import StrUtil
+from GuiState import GuiState
+from SnapshotCache import PrefixSnapshotCache
+from HierarchyDump import AdbHierarchyDump
+from const import UI_WAIT, UI_WAIT_MIN, UI_WAIT_POLL, UI_WAIT_STABLE, PREFIX_SNAPSHOT, PAGE_SOURCE_BACKEND
 
 
 class Runner:
+    # one shell command for the focused app and the keyboard, see get_state
+    DUMPSYS_ARGS = ['window', '|', 'grep', '-E', "'mCurrentFocus|mFocusedApp'", ';',
+                    'dumpsys', 'input_method', '|', 'grep', 'mInputShown']
+    FOCUS_PATTERN = re.compile(r'(mFocusedApp|mCurrentFocus)=.*?([^\s/{}]+)/([^\s/{},]+)')
+
     def __init__(self, pkg, act, no_reset=False, appium_port='4723', udid=None):
         desired_caps = Runner.set_caps(pkg, act, no_reset, udid)
         capabilities_options = UiAutomator2Options().load_capabilities(desired_caps)
         self.driver = webdriver.Remote(command_executor='http://localhost:' + appium_port, options=capabilities_options)
         self.databank = Databank()
         self.act_interval = 2
+        self.wait_stats = {'waits': 0, 'seconds': 0.0, 'saved': 0.0}  # saved: compared with the fixed waits
+        self.snapshots = PrefixSnapshotCache(udid) if PREFIX_SNAPSHOT else None
+        self.history = None  # the actions performed since the app was launched by perform_actions, None if unknown
+        self.seen_signature = None  # (len(history), signature) of the GUI state last seen, see get_resume_point
+        self.state = {}  # memo of get_state, cleared by invalidate_state whenever the UI may have changed
+        self.use_shell = True  # False once 'mobile: shell' is refused (appium needs --allow-insecure=adb_shell)
+        self.hierarchy_dump = AdbHierarchyDump(udid) if PAGE_SOURCE_BACKEND == 'adb_dump' else None
 
     @staticmethod
     def set_caps(app_name, app_activity, no_reset=False, udid=None):
@@ -39,7 +55,19 @@ class Runner:
             caps['udid'] = udid
         return caps
 
-    def perform_actions(self, action_list, require_wait=False, reset=True, cgp=None):
+    def perform_actions(self, action_list, require_wait=False, reset=True, cgp=None, use_snapshots=True):
+        """Run the actions, from the app launch if reset. Return how many of them were restored from a prefix
+        snapshot instead of being run (use_snapshots=False runs all of them, e.g., to test the learned actions)
+        """
+        prefix = action_list if reset and use_snapshots and self.snapshots is not None else None  # snapshot when done
+        restored = 0
+        if prefix:
+            restored = self.snapshots.restore(prefix)
+            if restored:  # the device is in the state after the first events; run the rest only
+                action_list = action_list[restored:]
+                reset = False
+                self.history = list(prefix[:restored])
+                self.invalidate_state()
         if reset:
             if self.driver.desired_capabilities['desired']['noReset']:
                 # self.driver.launch_app() is deprecated
@@ -50,6 +78,8 @@ class Runner:
                 subprocess.run(f"adb shell pm clear {self.driver.desired_capabilities['appPackage']}".split(),
                                 stdout=subprocess.DEVNULL)
                 self.driver.activate_app(app_id=self.driver.desired_capabilities['appPackage'])
+            self.history = []
+            self.invalidate_state()
         #time.sleep(self.act_interval)
 
         # specific for Ru email apps: a43-a45
@@ -80,7 +110,9 @@ class Runner:
         # except:
         #     pass
         for i, action in enumerate(action_list):
-            time.sleep(self.act_interval)
+            self.wait_for_idle(self.act_interval, f"before {action.get('action', [''])[0]} {action['class']}")
+            if self.history is not None:
+                self.history.append(action)
             # print(f'doing action: {action}')
             # print(driver.page_source)
             # if the action is SYS_EVENT, no need to get the element
@@ -163,7 +195,7 @@ class Runner:
                     ele.send_keys(value_for_input)
                     if action['action'][0].endswith('hide_keyboard'):
                         ele.click()
-                        time.sleep(self.act_interval/2)
+                        self.wait_for_idle(self.act_interval/2, 'before hide_keyboard')
                         self.hide_keyboard()
                     elif action['action'][0].endswith('enter'):
                         self.driver.press_keycode(66)  # AndroidKeyCode for 'Enter'
@@ -203,15 +235,50 @@ class Runner:
                     ta.long_press(ele).perform()
                 else:
                     assert False, "Unknown action to be performed"
+                self.invalidate_state()
                 act_to = self.get_current_package() + self.get_current_activity()
                 if action['action'][0] in ['click', 'long_press'] and cgp:
                     cgp.add_edge(act_from, act_to, action)
 
         if require_wait:
-            time.sleep(self.act_interval*2)
+            self.wait_for_idle(self.act_interval*2, 'after actions (require_wait)')
         else:
             # time.sleep(self.act_interval/2)
-            time.sleep(self.act_interval)
+            self.wait_for_idle(self.act_interval, 'after actions')
+        if prefix:
+            self.snapshots.save(prefix)
+        return restored
+
+    def wait_for_idle(self, max_wait, label=''):
+        """Wait for the UI to settle: with UI_WAIT = 'adaptive', until the page source has not changed in the polls of
+        the last UI_WAIT_STABLE seconds, between UI_WAIT_MIN and max_wait seconds; with UI_WAIT = 'fixed', sleep max_wait.
+        Each wait is printed with what it was for; return the seconds waited
+        """
+        start = time.time()
+        self.invalidate_state()
+        if UI_WAIT == 'fixed':
+            time.sleep(max_wait)
+        else:
+            time.sleep(min(UI_WAIT_MIN, max_wait))
+            try:
+                prev = self.fetch_page_source()
+                stable_since = time.time()
+                while time.time() - start + UI_WAIT_POLL <= max_wait:
+                    time.sleep(UI_WAIT_POLL)
+                    source = self.fetch_page_source()
+                    if source != prev:
+                        prev, stable_since = source, time.time()
+                    elif time.time() - stable_since >= UI_WAIT_STABLE:
+                        self.state['page_source'] = source  # stable, reused by get_state
+                        break
+            except WebDriverException:  # e.g., the app is restarting; wait as long as the fixed wait
+                time.sleep(max(0, max_wait - (time.time() - start)))
+        waited = time.time() - start
+        print(f'UI wait {label}: {waited:.2f}s of {max_wait}s')
+        self.wait_stats['waits'] += 1
+        self.wait_stats['seconds'] += waited
+        self.wait_stats['saved'] += max(0.0, max_wait - waited)
+        return waited
 
     def get_web_element(self, action):
         ele = None
@@ -288,21 +355,94 @@ class Runner:
             return False
 
     def get_current_activity(self):
-        return self.driver.current_activity
+        return self.get_state(page_source=False)['activity']
 
     def get_page_source(self):
         self.hide_keyboard()
-        return self.driver.page_source
+        return self.get_state()['page_source']
 
     def get_current_package(self):
-        return self.driver.current_package
+        return self.get_state(page_source=False)['package']
+
+    def get_state(self, page_source=True):
+        """package, activity and keyboard_shown of the device with one 'mobile: shell' call (dumpsys), and page_source
+        with one more, instead of one Appium call each. Memoized until the next action or wait (invalidate_state)
+        """
+        if 'package' not in self.state:
+            self.state.update(self.fetch_window_state())
+        if page_source and 'page_source' not in self.state:
+            self.state['page_source'] = self.fetch_page_source()
+        return self.state
+
+    def fetch_page_source(self):
+        """From the backend set by PAGE_SOURCE_BACKEND; appium's page_source if the hierarchy dump fails"""
+        if self.hierarchy_dump is not None:
+            page_source = self.hierarchy_dump.get_page_source()
+            if page_source is not None:
+                return page_source
+        return self.driver.page_source
+
+    def invalidate_state(self):
+        self.state = {}
+
+    def fetch_window_state(self):
+        if self.use_shell:
+            try:
+                output = self.driver.execute_script('mobile: shell', {'command': 'dumpsys', 'args': Runner.DUMPSYS_ARGS})
+                state = Runner.parse_window_state(output)
+                if state:
+                    return state
+            except WebDriverException as excep:
+                print(f"'mobile: shell' not available, fall back to one Appium call per property: {excep.msg}")
+                self.use_shell = False
+        # e.g., no focused window while switching activities
+        return {'package': self.driver.current_package, 'activity': self.driver.current_activity,
+                'keyboard_shown': self.driver.is_keyboard_shown()}
+
+    @staticmethod
+    def parse_window_state(output):
+        """package, activity (as given by dumpsys, like appium's current_activity) and keyboard_shown from the
+        output of DUMPSYS_ARGS; None if there is no focused app
+        """
+        focus = {}
+        for name, pkg, act in Runner.FOCUS_PATTERN.findall(output):
+            focus.setdefault(name, (pkg, act))
+        pkg_act = focus.get('mFocusedApp') or focus.get('mCurrentFocus')
+        if not pkg_act:
+            return None
+        return {'package': pkg_act[0], 'activity': pkg_act[1], 'keyboard_shown': 'mInputShown=true' in output}
+
+    def get_gui_state(self):
+        """The current screen, parsed once and shared by all the widget queries on it"""
+        state = GuiState(self.get_page_source(), self.get_current_package(), self.get_current_activity())
+        if self.history is not None:
+            self.seen_signature = (len(self.history), state.get_signature())
+        return state
+
+    def get_resume_point(self, events):
+        """How many of the events (to be run from the app launch) the device has run already, if it can continue
+        from there without a reset; None otherwise. The actions performed since the launch must be the first events,
+        and the current GUI state must be the one seen right after them
+        """
+        if self.history is None or self.seen_signature is None:
+            return None
+        n = len(self.history)
+        if n > len(events) or self.seen_signature[0] != n or self.history != list(events[:n]):
+            return None
+        expected = self.seen_signature[1]
+        self.invalidate_state()  # the screen may have changed by itself since it was seen
+        if self.get_gui_state().get_signature() != expected:
+            return None
+        return n
 
     def hide_keyboard(self):
-        if self.driver.is_keyboard_shown:
+        if self.get_state(page_source=False)['keyboard_shown']:
             try:
                 self.driver.hide_keyboard()
             except WebDriverException:
                 pass
+            self.state.pop('page_source', None)
+            self.state['keyboard_shown'] = False
 
     # def is_waited_element_present(self, event):
     #     wait_time, selector_type, selector = event['action'][1:]
@@ -0,0 +1,61 @@
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# local import
+from const import W2V_URL, W2V_MODEL_PATH, W2V_TIMEOUT, W2V_RETRIES, W2V_BUSY_RETRIES
+
+
+class HttpSimBackend:
+    """Query similarity scores from w2v_service.py (run it first to activate the w2v service).
+    s_new and s_old are sent as lists of tokens already split and normalized by StrUtil.tokenize
+    """
+
+    def __init__(self, url=W2V_URL):
+        self.url = url
+        # one keep-alive connection reused by all queries, instead of a new TCP connection per query
+        self.session = requests.Session()
+        retry = Retry(total=None, connect=W2V_RETRIES, read=W2V_RETRIES, other=0, status=W2V_BUSY_RETRIES,
+                      backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=['POST'],
+                      respect_retry_after_header=True)
+        self.session.mount('http://', HTTPAdapter(max_retries=retry))
+        self.session.headers.update({'Content-Type': 'application/json'})
+
+    def post(self, data):
+        resp = self.session.post(url=self.url, data=json.dumps(data), timeout=W2V_TIMEOUT)
+        resp.raise_for_status()
+        return resp.json()
+
+    def sent_sim(self, s_new, s_old):
+        resp = self.post({'s_new': s_new, 's_old': s_old})
+        if 'sent_sim' in resp and resp['sent_sim']:
+            return resp['sent_sim']
+        else:
+            return None
+
+    def sent_sim_batch(self, pairs):
+        resp = self.post({'pairs': pairs})
+        if 'sent_sims' in resp:
+            return [sim if sim else None for sim in resp['sent_sims']]
+        else:
+            return [None] * len(pairs)
+
+
+class LocalSimBackend:
+    """Run the w2v_service scoring logic inside the current process, without JSON/HTTP in between"""
+
+    def __init__(self):
+        import w2v_service  # heavy import (gensim); only needed when this backend is chosen
+        w2v_service.init(W2V_MODEL_PATH or None)
+        self.service = w2v_service
+
+    def sent_sim(self, s_new, s_old):
+        sim = self.service.w2v_sent_sim(s_new, s_old)
+        return sim if sim else None
+
+    def sent_sim_batch(self, pairs):
+        return [sim if sim else None for sim in self.service.w2v_sent_sim_batch(pairs)]
+
+
+SIM_BACKENDS = {'http': HttpSimBackend, 'local': LocalSimBackend}
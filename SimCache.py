@@ -0,0 +1,129 @@
+import os
+import pickle
+import sqlite3
+import threading
+
+
+class SimCache:
+    """Persistent cache of similarity scores, backed by a SQLite table.
+
+    Every new score is a single-row insert, and inserts are committed in batches of `commit_every`,
+    so adding an entry costs O(1) instead of rewriting the whole cache file. Keys are symmetric:
+    (a, b) and (b, a) resolve to the same entry. A score of None (e.g., out-of-vocabulary word) is cached too.
+    With shared=True, several processes use the same file: a miss in memory is looked up in the table,
+    which may have been filled by another process since this one started.
+    """
+    MISSING = object()
+
+    def __init__(self, db_path, commit_every=100, shared=False):
+        self.db_path = db_path
+        self.commit_every = commit_every
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')  # a crash loses the uncommitted tail only
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sim (w1 TEXT NOT NULL, w2 TEXT NOT NULL, score REAL, '
+                          'PRIMARY KEY (w1, w2)) WITHOUT ROWID')
+        self.conn.commit()
+        self.mem = {(w1, w2): score for w1, w2, score in self.conn.execute('SELECT w1, w2, score FROM sim')}
+        self.pending = 0
+
+    @staticmethod
+    def get_key(w1, w2):
+        return (w1, w2) if w1 <= w2 else (w2, w1)
+
+    def __len__(self):
+        return len(self.mem)
+
+    def __contains__(self, pair):
+        return SimCache.get_key(*pair) in self.mem
+
+    def get(self, w1, w2, default=MISSING):
+        """Return the cached score of (w1, w2), or `default` (SimCache.MISSING) if the pair was never scored"""
+        key = SimCache.get_key(w1, w2)
+        if key in self.mem or not self.shared:
+            return self.mem.get(key, default)
+        with self.lock:
+            row = self.conn.execute('SELECT score FROM sim WHERE w1 = ? AND w2 = ?', key).fetchone()
+        if row is None:
+            return default
+        self.mem[key] = row[0]
+        return row[0]
+
+    def put(self, w1, w2, score):
+        key = SimCache.get_key(w1, w2)
+        with self.lock:
+            self.mem[key] = score
+            self.conn.execute('INSERT OR REPLACE INTO sim (w1, w2, score) VALUES (?, ?, ?)', (key[0], key[1], score))
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.conn.commit()
+                self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            if self.pending:
+                self.conn.commit()
+                self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def import_pickle(self, pkl_path):
+        """One-time migration of a cache dict pickled by the previous versions of w2v_service.py"""
+        if not os.path.exists(pkl_path):
+            return 0
+        with open(pkl_path, 'rb') as f:
+            cached_sim = pickle.load(f)
+        with self.lock:
+            rows = []
+            for (w1, w2), score in cached_sim.items():
+                key = SimCache.get_key(w1, w2)
+                self.mem[key] = score
+                rows.append((key[0], key[1], score))
+            self.conn.executemany('INSERT OR REPLACE INTO sim (w1, w2, score) VALUES (?, ?, ?)', rows)
+            self.conn.commit()
+        return len(rows)
+
+
+class SingleFlight:
+    """Merge identical in-flight computations: while a key is being computed by one thread,
+    other threads asking for the same key wait for that result instead of computing it again
+    """
+
+    class Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.merged = 0  # number of requests served by another thread's computation
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self.calls[key] = SingleFlight.Call()
+            else:
+                self.merged += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as excep:
+            call.error = excep
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
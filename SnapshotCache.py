@@ -0,0 +1,115 @@
+import os
+import sys
+import glob
+import hashlib
+import subprocess
+
+# local import
+from LRUCache import LRUCache
+from StrUtil import StrUtil
+from WidgetUtil import WidgetUtil
+from const import PREFIX_SNAPSHOT_MIN_EVENTS, PREFIX_SNAPSHOT_MAX_BYTES, PREFIX_SNAPSHOT_EST_BYTES, \
+    PREFIX_SNAPSHOT_TIMEOUT
+
+
+class PrefixSnapshotCache:
+    """Emulator snapshots (adb emu avd snapshot) of the device right after a prefix of target events ran from the
+    app launch, keyed by a hash of the prefix (widget signatures and actions of its events).
+    restore() loads the snapshot of the longest cached prefix of the events to run, so only the rest of them is
+    replayed. The snapshots are deleted, least recently used first, when their total size on disk exceeds the budget
+    (a snapshot not found on this host counts as PREFIX_SNAPSHOT_EST_BYTES).
+    Prefixes that type an email are not cached: the temporary email of Databank changes between replays
+    """
+    NAME_PREFIX = 'craftdroid-prefix-'
+
+    def __init__(self, udid=None, min_events=PREFIX_SNAPSHOT_MIN_EVENTS, max_bytes=PREFIX_SNAPSHOT_MAX_BYTES):
+        self.adb = ['adb', '-s', udid] if udid else ['adb']
+        self.min_events = min_events
+        self.snapshots = LRUCache(sys.maxsize, max_bytes, sizeof=lambda s: s['bytes'],
+                                  on_evict=lambda key, s: self.run_snapshot_cmd('delete', s['name']))
+        self.enabled = True  # off after a failed adb command, e.g., the device is not an emulator
+        self.stats = {'saved': 0, 'restored': 0, 'events_skipped': 0, 'estimated_sizes': 0}
+
+    @staticmethod
+    def get_keys(events):
+        """The hash of each prefix of the events: keys[i] for the first i+1 events"""
+        keys = []
+        digest = hashlib.sha1()
+        for e in events:
+            digest.update(repr((WidgetUtil.get_widget_signature(e), list(e.get('action', [])))).encode('utf-8'))
+            keys.append(digest.hexdigest())
+        return keys
+
+    @staticmethod
+    def is_cacheable(events):
+        for e in events:
+            action = e.get('action', [])
+            if action and 'send_keys' in action[0] and StrUtil.is_contain_email(action[1]):
+                return False
+        return True
+
+    def restore(self, events):
+        """Load the snapshot of the longest cached prefix of the events; return its length, 0 if there is none"""
+        if not self.enabled or len(events) < self.min_events:
+            return 0
+        keys = PrefixSnapshotCache.get_keys(events)
+        for n in range(len(events), self.min_events - 1, -1):
+            if keys[n - 1] in self.snapshots:
+                snapshot = self.snapshots.get(keys[n - 1])
+                if not self.run_snapshot_cmd('load', snapshot['name']):
+                    return 0
+                self.stats['restored'] += 1
+                self.stats['events_skipped'] += n
+                return n
+        return 0
+
+    def save(self, events):
+        """Save a snapshot of the device, which is in the state right after the events ran from the app launch"""
+        if not self.enabled or len(events) < self.min_events or not PrefixSnapshotCache.is_cacheable(events):
+            return
+        key = PrefixSnapshotCache.get_keys(events)[-1]
+        if key in self.snapshots:
+            return
+        name = PrefixSnapshotCache.NAME_PREFIX + key[:16]
+        if self.run_snapshot_cmd('save', name):
+            size = PrefixSnapshotCache.get_snapshot_size(name)
+            if not size:
+                if not self.stats['estimated_sizes']:
+                    print(f'Snapshot {name} not found under the AVD folder (ANDROID_AVD_HOME); the disk budget counts '
+                          f'{PREFIX_SNAPSHOT_EST_BYTES} bytes per snapshot instead')
+                self.stats['estimated_sizes'] += 1
+                size = PREFIX_SNAPSHOT_EST_BYTES
+            self.snapshots.put(key, {'name': name, 'bytes': size})
+            self.stats['saved'] += 1
+
+    def clear(self):
+        """Delete all the snapshots taken, e.g., at the end of a transfer"""
+        for s in list(self.snapshots.data.values()):
+            self.run_snapshot_cmd('delete', s['name'])
+        self.snapshots.clear()
+
+    def run_snapshot_cmd(self, cmd, name):
+        try:
+            p = subprocess.run(self.adb + ['emu', 'avd', 'snapshot', cmd, name], capture_output=True, text=True,
+                               timeout=PREFIX_SNAPSHOT_TIMEOUT)
+            if p.returncode == 0 and 'KO' not in p.stdout:
+                return True
+            print(f'Failed to {cmd} snapshot {name}: {p.stdout.strip()} {p.stderr.strip()}')
+        except (OSError, subprocess.TimeoutExpired) as excep:
+            print(f'Failed to {cmd} snapshot {name}: {excep}')
+        print('Prefix snapshots disabled')
+        self.enabled = False
+        return False
+
+    @staticmethod
+    def get_snapshot_size(name):
+        """Bytes taken by the snapshot in the AVD folder of the emulator (0 if it is not found on this host)"""
+        avd_home = os.environ.get('ANDROID_AVD_HOME', os.path.expanduser('~/.android/avd'))
+        size = 0
+        for folder in glob.glob(os.path.join(avd_home, '*.avd', 'snapshots', name)):
+            for root, _, files in os.walk(folder):
+                size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return size
+
+    def get_stats(self):
+        return dict(self.stats, enabled=self.enabled, snapshots=len(self.snapshots), bytes=self.snapshots.bytes)
@@ -1,10 +1,20 @@
 import re
+import time
 import requests
-import json
+
+# local import
+from const import SIM_BACKEND, SIM_MEMO_SIZE
+from SimBackend import SIM_BACKENDS
+from LRUCache import LRUCache
 
 
 class StrUtil:
 
+    sim_backend = None  # created on first use, see get_sim_backend()
+    sim_memo = LRUCache(SIM_MEMO_SIZE)  # (s_new, s_old) -> score, for queries repeated across rounds
+    NOT_MEMOIZED = object()
+    sim_queries = {'queries': 0, 'pairs': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'failed': 0}  # queries sent to the backend
+
     # stop words from nltk
     STOPWORDS = {'ourselves', 'hers', 'between', 'yourself', 'but', 'again', 'there', 'about', 'once', 'during',
                  'out', 'very', 'having', 'with', 'they', 'own', 'an', 'be', 'some', 'for', 'do', 'its', 'yours',
@@ -93,6 +103,19 @@ class StrUtil:
                 res = StrUtil.merge_sibling_text(res)
             res = StrUtil.rmv_stopwords(res) if use_stopwords else res
             return res
+        elif s_type == 'filename':
+            # e.g., 'ic_menu_search.png'
+            return StrUtil.tokenize('resource-id', s.rsplit('.', 1)[0], use_stopwords)
+        elif s_type == 'atm_neighbor':
+            # a list of neighbor refs (resource-id names or texts), e.g., ['add_todo_fab', 'Sign in']
+            res = []
+            for ref in s:
+                for word in StrUtil.sanitize(ref).split():
+                    for token in word.split('_'):
+                        res += [t.lower() for t in StrUtil.camel_case_split(token)]
+            res = list(dict.fromkeys(res))  # neighbors often share words
+            res = StrUtil.rmv_stopwords(res) if use_stopwords else res
+            return res
         elif s_type == 'Activity':
             act_id = s.split('.')[-1]
             act_id = StrUtil.sanitize(act_id)
@@ -155,17 +178,75 @@ class StrUtil:
             else:
                 return w_split_text
 
+    @classmethod
+    def get_sim_backend(cls):
+        if cls.sim_backend is None:
+            assert SIM_BACKEND in SIM_BACKENDS, f'Unknown similarity backend: {SIM_BACKEND}'
+            cls.sim_backend = SIM_BACKENDS[SIM_BACKEND]()
+        return cls.sim_backend
+
     @staticmethod
     def w2v_sent_sim(s_new, s_old):
-        # run w2v_service.py first to activate the w2v service
-        data = {'s_new': s_new, 's_old': s_old}
-        if len(s_new) == 0 or len(s_old) == 0:
-            return None
-        resp = requests.post(url='http://127.0.0.1:5000/w2v', headers={'Content-Type': 'application/json'}, data=json.dumps(data)).json()
-        if 'sent_sim' in resp and resp['sent_sim']:
-            return resp['sent_sim']
-        else:
-            return None
+        return StrUtil.w2v_sent_sim_batch([(s_new, s_old)])[0]
+
+    @staticmethod
+    def w2v_sent_sim_batch(pairs):
+        """Score a list of (s_new, s_old) pairs with at most one query to the similarity backend.
+        The result has one score (or None) per pair, in the same order as the pairs.
+        Pairs answered before are served from the in-process memo
+        """
+        scores = [None] * len(pairs)
+        to_query = {}  # memo key -> indices of the pairs
+        for i, (s_new, s_old) in enumerate(pairs):
+            if len(s_new) == 0 or len(s_old) == 0:
+                continue
+            key = (StrUtil.get_memo_key(s_new), StrUtil.get_memo_key(s_old))
+            if key in to_query:
+                to_query[key].append(i)
+                continue
+            sim = StrUtil.sim_memo.get(key, StrUtil.NOT_MEMOIZED)
+            if sim is StrUtil.NOT_MEMOIZED:
+                to_query[key] = [i]
+            else:
+                scores[i] = sim
+        if not to_query:
+            return scores
+        query = [pairs[indices[0]] for indices in to_query.values()]
+        t_start = time.time()
+        try:
+            sims = StrUtil.get_sim_backend().sent_sim_batch(query)
+        except requests.exceptions.RequestException as excep:
+            # e.g., the w2v service is still busy after the retries: the pairs score None (not memoized), as a failed
+            # pair did before, instead of stopping the transfer
+            print(f'Failed to score {len(query)} pairs: {excep}')
+            StrUtil.sim_queries['failed'] += 1
+            return scores
+        StrUtil.record_sim_query(len(query), time.time() - t_start)
+        for (key, indices), sim in zip(to_query.items(), sims):
+            StrUtil.sim_memo.put(key, sim)
+            for i in indices:
+                scores[i] = sim
+        return scores
+
+    @staticmethod
+    def get_memo_key(s):
+        if isinstance(s, str):
+            return s
+        return tuple(t if isinstance(t, str) else str(t) for t in s)
+
+    @classmethod
+    def record_sim_query(cls, num_pairs, seconds):
+        cls.sim_queries['queries'] += 1
+        cls.sim_queries['pairs'] += num_pairs
+        cls.sim_queries['seconds'] += seconds
+        cls.sim_queries['max_seconds'] = max(cls.sim_queries['max_seconds'], seconds)
+
+    @classmethod
+    def get_sim_stats(cls):
+        """Counters of the similarity client: memo hits/misses and the latency of the queries sent to the backend"""
+        queries = dict(cls.sim_queries)
+        queries['avg_seconds'] = queries['seconds'] / queries['queries'] if queries['queries'] else 0.0
+        return {'memo': cls.sim_memo.stats(), 'backend': queries}
 
     @staticmethod
     def get_tid(fname):
@@ -1,14 +1,13 @@
 import json
 import os
 from copy import deepcopy
-from bs4 import BeautifulSoup
-from bs4.element import Tag  # 正确导入Tag类
 
 # from numpy import dot
 # from numpy.linalg import norm
 
 from const import TEST_REPO
 from Databank import Databank
+from Widget import Widget
 import imaplib
 
 
@@ -32,29 +31,20 @@ class Util:
         return attrs
 
     @staticmethod
-    def save_events(events, config_id):
-        # 定义一个转换函数来处理不可序列化的对象
-        def convert_to_serializable(obj):
-            if isinstance(obj, Tag):  # 使用导入的Tag类
-                return str(obj)  # 将 BeautifulSoup Tag 对象转换为字符串
-            elif isinstance(obj, list):
-                return [convert_to_serializable(item) for item in obj]
-            elif isinstance(obj, dict):
-                return {key: convert_to_serializable(value) for key, value in obj.items()}
-            else:
-                return obj
-
-        # 转换所有事件为可序列化的格式
-        serializable_events = convert_to_serializable(events)
+    def to_dicts(events):
+        """The events as plain dicts (Widget.to_dict, also for the stepping_events), e.g., for JSON"""
+        return [e.to_dict() if isinstance(e, Widget) else e for e in events]
 
+    @staticmethod
+    def save_events(events, config_id):
         # 检查 'output/' 目录是否存在，如果不存在，则创建它
         output_dir = 'output'
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        # 继续现有的保存逻辑
+        # 保存事件
         with open(f'{output_dir}/{config_id}.json', 'w') as f:
-            json.dump(serializable_events, f, indent=2)
+            json.dump(Util.to_dicts(events), f, indent=2)
 
     @staticmethod
     def save_aug_events(actions, fpath):
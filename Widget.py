@@ -0,0 +1,132 @@
+import sys
+
+
+class Widget:
+    """An immutable widget/event that reads like the dict it was built from (w['text'], 'text' in w, w.get, items).
+
+    The keys are stored once per distinct key tuple (shape), shared by all widgets with the same keys, and the
+    values in a tuple with the strings interned. set() and update() return a new Widget that shares the unchanged
+    values, so events are never deep-copied. The signature (see WidgetUtil.get_widget_signature) is computed once
+    at creation; the tokens of the similarity attributes are cached by WidgetUtil.get_tokens and kept by updates
+    that do not touch them. to_dict() gives back the plain dict, with the same key order, e.g., for JSON
+    """
+    __slots__ = ['shape', 'data', 'signature', 'tokens']
+
+    FEATURE_KEYS = ['class', 'resource-id', 'text', 'content-desc', 'clickable', 'password', 'naf']
+    # 包含新的属性在计算相似度时使用
+    SIM_ATTRS = ['resource-id', 'text', 'content-desc', 'parent_text', 'sibling_text', 'filename', 'atm_neighbor']
+    SIGNATURE_KEYS = FEATURE_KEYS + ['package', 'activity']
+    TOKEN_KEYS = set(SIM_ATTRS + ['class'])  # the tokens depend on these keys only
+    shapes = {}  # keys -> (keys, {key: position})
+
+    def __init__(self, keys, data):
+        self.shape = Widget.get_shape(keys)
+        self.data = data
+        index = self.shape[1]
+        sign = []
+        for k in Widget.SIGNATURE_KEYS:
+            v = data[index[k]] if k in index else ''
+            sign.append(v if isinstance(v, str) else str(v))
+        self.signature = '!'.join(sign)
+        self.tokens = None
+
+    @classmethod
+    def get_shape(cls, keys):
+        if keys not in cls.shapes:
+            keys = tuple(sys.intern(k) for k in keys)
+            cls.shapes[keys] = (keys, {k: i for i, k in enumerate(keys)})
+        return cls.shapes[keys]
+
+    @classmethod
+    def from_dict(cls, d):
+        if isinstance(d, Widget):
+            return d
+        return cls(tuple(d.keys()), tuple(Widget.freeze(v) for v in d.values()))
+
+    @staticmethod
+    def freeze(v):
+        if isinstance(v, str):
+            return sys.intern(v)
+        if isinstance(v, list):
+            return tuple(Widget.freeze(x) for x in v)
+        if isinstance(v, dict):
+            return Widget.from_dict(v)
+        return v  # numbers, None, tuples (already frozen) and widgets
+
+    @staticmethod
+    def thaw(v):
+        if isinstance(v, tuple):
+            return [Widget.thaw(x) for x in v]
+        if isinstance(v, Widget):
+            return v.to_dict()
+        return v
+
+    def to_dict(self):
+        return {k: Widget.thaw(v) for k, v in zip(self.shape[0], self.data)}
+
+    def set(self, key, value):
+        return self.update({key: value})
+
+    def update(self, changes):
+        keys, index = self.shape
+        new_keys = None
+        data = list(self.data)
+        for k, v in changes.items():
+            if k in index:
+                data[index[k]] = Widget.freeze(v)
+            else:
+                new_keys = (new_keys or list(keys)) + [k]
+                data.append(Widget.freeze(v))
+        w = Widget(tuple(new_keys) if new_keys else keys, tuple(data))
+        if not Widget.TOKEN_KEYS.intersection(changes):
+            w.tokens = self.tokens
+        return w
+
+    def __getitem__(self, key):
+        return self.data[self.shape[1][key]]
+
+    def __setitem__(self, key, value):
+        raise TypeError('Widget is immutable, use set() or update()')
+
+    def __contains__(self, key):
+        return key in self.shape[1]
+
+    def __iter__(self):
+        return iter(self.shape[0])
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        i = self.shape[1].get(key)
+        return default if i is None else self.data[i]
+
+    def keys(self):
+        return self.shape[0]
+
+    def values(self):
+        return self.data
+
+    def items(self):
+        return zip(self.shape[0], self.data)
+
+    def __eq__(self, other):
+        if not isinstance(other, Widget):
+            return NotImplemented
+        return self.shape[0] == other.shape[0] and self.data == other.data
+
+    def __hash__(self):
+        return hash(self.data)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # rebuilt through __init__ when loading a snapshot, so the shapes are shared again
+        return Widget, (self.shape[0], self.data)
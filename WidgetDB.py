@@ -0,0 +1,86 @@
+class WidgetDB:
+    """The widgets known for the target app, by widget signature: static ones from sa_info and the ones seen
+    while exploring. Secondary indexes by class and (clickable, password) let most_similar select only the
+    candidates compatible with a source event. Static widgets have neither flag and are indexed under None.
+    An optional EmbeddingIndex is kept up to date with the widgets for vectorized scoring.
+    version changes whenever the content changes, so rankings computed against the DB can be reused until then.
+    Like a dict, the DB keeps the insertion order (a replaced widget keeps its place), and candidates come in that order
+    """
+
+    def __init__(self, embedding_index=None):
+        self.widgets = {}  # signature -> widget
+        self.index = {}  # class -> (clickable, password) -> {signature: widget}
+        self.order = {}  # signature -> insertion sequence number
+        self.next_order = 0
+        self.embedding_index = embedding_index
+        self.version = 0
+
+    def __len__(self):
+        return len(self.widgets)
+
+    def __contains__(self, signature):
+        return signature in self.widgets
+
+    def __getitem__(self, signature):
+        return self.widgets[signature]
+
+    def __setitem__(self, signature, w):
+        if self.widgets.get(signature) == w:
+            return  # the same widget seen again; keep the stored one and the version
+        if signature in self.widgets:
+            self.unindex(signature, self.widgets[signature])
+        else:
+            self.order[signature] = self.next_order
+            self.next_order += 1
+        self.version += 1
+        self.widgets[signature] = w
+        self.index.setdefault(w.get('class'), {}).setdefault(WidgetDB.get_flags(w), {})[signature] = w
+        if self.embedding_index is not None:
+            self.embedding_index.add(signature, w)
+
+    def pop(self, signature, default=None):
+        if signature not in self.widgets:
+            return default
+        w = self.widgets.pop(signature)
+        del self.order[signature]
+        self.version += 1
+        self.unindex(signature, w)
+        return w
+
+    def unindex(self, signature, w):
+        buckets = self.index[w.get('class')]
+        flags = WidgetDB.get_flags(w)
+        del buckets[flags][signature]
+        if not buckets[flags]:
+            del buckets[flags]
+        if self.embedding_index is not None:
+            self.embedding_index.remove(signature)
+
+    def keys(self):
+        return self.widgets.keys()
+
+    def values(self):
+        return self.widgets.values()
+
+    def items(self):
+        return self.widgets.items()
+
+    @staticmethod
+    def get_flags(w):
+        return w.get('clickable'), w.get('password')
+
+    def get_candidates(self, classes, clickable, password, any_clickable_classes=()):
+        """(signature, widget) of the given classes whose password flag is the same as password, and whose clickable
+        flag is the same as clickable (any value for the classes in any_clickable_classes). Static widgets always qualify.
+        They come in insertion order, so that equal scores are ranked as when the whole DB was scanned
+        """
+        candidates = []
+        for w_class in dict.fromkeys(classes):
+            for (w_clickable, w_password), bucket in self.index.get(w_class, {}).items():
+                if w_password is not None and w_password != password:
+                    continue
+                if w_clickable is not None and w_clickable != clickable and w_class not in any_clickable_classes:
+                    continue
+                candidates.extend(bucket.items())
+        candidates.sort(key=lambda c: self.order[c[0]])
+        return candidates
@@ -1,42 +1,36 @@
-from bs4 import BeautifulSoup
-import xml.etree.ElementTree as ET
 import re
+import heapq
 from StrUtil import StrUtil
+from GuiState import GuiState
+from Widget import Widget
+from LRUCache import LRUCache
+from const import STATE_CACHE_MAX_ENTRIES, STATE_CACHE_MAX_BYTES
 
 class WidgetUtil:
-    FEATURE_KEYS = ['class', 'resource-id', 'text', 'content-desc', 'clickable', 'password', 'naf']
+    FEATURE_KEYS = Widget.FEATURE_KEYS
+    SIM_ATTRS = Widget.SIM_ATTRS
     WIDGET_CLASSES = ['android.widget.EditText', 'android.widget.MultiAutoCompleteTextView', 'android.widget.TextView',
                       'android.widget.Button', 'android.widget.ImageButton', 'android.view.View']
-    state_to_widgets = {}  # for a gui state, there are "all_widgets": a list of all widgets, and
-                           # "most_similar_widgets": a dict for a source widget and the list of its most similar widgets and scores
+    # for a gui state, there are "all_widgets": a list of all widgets, and
+    # "most_similar_widgets": a dict for a source widget (and the ranking options) and the list of its most similar
+    # widgets and scores, with the widget_db version they were ranked against (see get_ranking_key)
+    # bounded by the number of states and their approximate size; least recently used states are evicted first
+    state_to_widgets = LRUCache(STATE_CACHE_MAX_ENTRIES, STATE_CACHE_MAX_BYTES)
+    ranking_stats = {'hits': 0, 'misses': 0, 'outdated': 0}  # lookups of most_similar_widgets
 
     def __init__(self):
         pass  # 如果有需要，可以在这里进行初始化操作
 
     @staticmethod
-    def get_gui_signature(xml_dom, pkg_name, act_name):
-        """Get the signature for a GUI state by the package/activity name and the xml hierarchy
-        Breadth first traversal for the non-leaf/leaf nodes and their cumulative index sequences
-        """
-        xml_dom = re.sub(r'&#\d+;', "", xml_dom)  # remove emoji
-        root = ET.fromstring(xml_dom)
-        queue = [(root, '0')]
-        layouts = []
-        executable_leaves = []
-        while queue:
-            node, idx = queue.pop()
-            if len(list(node)):  # the node has child(ren)
-                layouts.append(idx)
-                for i, child in enumerate(node):
-                    queue.insert(0, (child, idx + '-' + str(i)))
-            else:  # a leaf node
-                executable_leaves.append(idx)
-        sign = [pkg_name, act_name, '+'.join(layouts), '+'.join(executable_leaves)]
-        return '!'.join(sign)
+    def get_gui_signature(xml_dom, pkg_name, act_name, canonical=False):
+        """Get the signature for a GUI state by the package/activity name and the xml hierarchy"""
+        return GuiState(xml_dom, pkg_name, act_name).get_signature(canonical)
 
     @classmethod
     def get_widget_signature(cls, w):
         """Get the signature for a GUI widget by its attributes"""
+        if isinstance(w, Widget):
+            return w.signature  # computed when the widget was created
         sign = []
         for k in cls.FEATURE_KEYS + ['package', 'activity']:
             if k in w:
@@ -46,60 +40,95 @@ class WidgetUtil:
         return '!'.join(sign)
 
     @classmethod
-    def get_most_similar_widget_from_cache(cls, gui_signature, widget_signature):
-        """Return the most similar widget and the score to the source widget in a gui state in cache"""
-        if gui_signature not in cls.state_to_widgets:
-            return None, -1
-        if 'most_similar_widgets' in cls.state_to_widgets[gui_signature]:
-            if widget_signature in cls.state_to_widgets[gui_signature]['most_similar_widgets']:
-                return cls.state_to_widgets[gui_signature]['most_similar_widgets'][widget_signature][0]
-        return None, -1
+    def get_most_similar_widgets_from_cache(cls, gui_signature, ranking_key, db_version):
+        """Return the cached ranking for the source widget in a gui state, or None if there is none for this
+        version of widget_db
+        """
+        cached = cls.state_to_widgets.get(gui_signature)
+        if not cached or ranking_key not in cached.get('most_similar_widgets', {}):
+            cls.ranking_stats['misses'] += 1
+            return None
+        version, similars = cached['most_similar_widgets'][ranking_key]
+        if version != db_version:
+            cls.ranking_stats['outdated'] += 1
+            return None
+        cls.ranking_stats['hits'] += 1
+        return similars
+
+    @classmethod
+    def put_most_similar_widgets_to_cache(cls, gui_signature, ranking_key, db_version, similars):
+        cached = cls.state_to_widgets.peek(gui_signature)
+        if cached is None:  # a state without widgets of the target app, or evicted
+            return
+        rankings = cached['most_similar_widgets']
+        # account for the size of this ranking only, rather than measuring all the widgets of the state again
+        size = LRUCache.deep_sizeof((ranking_key, (db_version, similars)))
+        if ranking_key in rankings:  # an outdated one, replaced
+            size -= LRUCache.deep_sizeof((ranking_key, rankings[ranking_key]))
+        rankings[ranking_key] = (db_version, similars)
+        cls.state_to_widgets.add_bytes(gui_signature, size)
+
+    @classmethod
+    def get_ranking_key(cls, src_event, use_stopwords, expand_btn_to_text, cross_check, top_k):
+        """What a ranking depends on: the source widget, its action, its tokens and the options of most_similar"""
+        action = src_event['action'][0] if 'action' in src_event else ''
+        tokens = cls.get_tokens(src_event, use_stopwords)
+        return (cls.get_widget_signature(src_event), action, tuple(tuple(tokens[a]) for a in cls.SIM_ATTRS),
+                use_stopwords, expand_btn_to_text, cross_check, top_k)
 
     @classmethod
     def get_all_widgets_from_cache(cls, gui_signature):
         """Return all widgets in a gui state in cache"""
-        if gui_signature in cls.state_to_widgets and 'all_widgets' in cls.state_to_widgets[gui_signature]:
-            return cls.state_to_widgets[gui_signature]['all_widgets']
+        cached = cls.state_to_widgets.get(gui_signature)
+        if cached and 'all_widgets' in cached:
+            return cached['all_widgets']
         else:
             return None
 
     @staticmethod
-    def get_parent_text(soup_ele):
+    def get_class(ele):
+        """The class name of an element (the first one, if several are given)"""
+        classes = (ele.get('class') or '').split()
+        return classes[0] if classes else ''
+
+    @staticmethod
+    def get_parent_text(ele):
         parent_text = ''
-        parent = soup_ele.find_parent()
-        if parent and 'text' in parent.attrs and parent['text']:
-            parent_text += parent['text']
-        parent = parent.find_parent()
-        if parent and 'text' in parent.attrs and parent['text'] and parent['class'][0] == 'TextInputLayout':
-            parent_text += parent['text']
+        parent = ele.getparent()
+        if parent is not None and parent.get('text'):
+            parent_text += parent.get('text')
+        parent = parent.getparent() if parent is not None else None
+        if parent is not None and parent.get('text') and WidgetUtil.get_class(parent).endswith('TextInputLayout'):
+            parent_text += parent.get('text')
         return parent_text
 
     @staticmethod
-    def get_sibling_text(soup_ele):
+    def get_sibling_text(ele):
         sibling_text = ''
-        parent = soup_ele.find_parent()
-        if parent and parent['class'][0] in ['android.widget.LinearLayout', 'android.widget.RelativeLayout']:
-            prev_sib = soup_ele.previous_sibling
-            if prev_sib and 'text' in prev_sib.attrs and prev_sib['text']:
-                sibling_text = prev_sib['text']
+        parent = ele.getparent()
+        if parent is not None and WidgetUtil.get_class(parent) in ['android.widget.LinearLayout',
+                                                                   'android.widget.RelativeLayout']:
+            prev_sib = ele.getprevious()
+            if prev_sib is not None and prev_sib.get('text'):
+                sibling_text = prev_sib.get('text')
         return sibling_text
 
     @classmethod
     def get_attrs(cls, dom, attr_name, attr_value, tag_name=''):
-        soup = BeautifulSoup(dom, 'lxml-xml')
+        state = GuiState(dom, '', '')
         if attr_name == 'text-contain':
-            cond = {'text': lambda x: x and attr_value in x}
+            cond = {'text': ('contains', attr_value)}
         else:
-            cond = {attr_name: attr_value}
+            cond = {attr_name: ('equals', attr_value)}
         if tag_name:
-            cond['class'] = tag_name
-        ele = soup.find(attrs=cond)
+            cond['class'] = ('equals', tag_name)
+        ele = state.find(cond)
         d = {}
         for key in cls.FEATURE_KEYS:
-            d[key] = ele.attrs[key] if key in ele.attrs else ""
+            d[key] = ele.get(key, "")
             if key == 'class':
-                d[key] = d[key][0]  # 只考虑第一个class
-            elif key == 'clickable' and key in ele.attrs and ele.attrs[key] == 'false':
+                d[key] = cls.get_class(ele)  # 只考虑第一个class
+            elif key == 'clickable' and ele.get(key) == 'false':
                 d[key] = WidgetUtil.propagate_clickable(ele)
 
         # 新增：获取parent_text和sibling_text
@@ -110,7 +139,7 @@ class WidgetUtil:
         d['filename'] = WidgetUtil.get_filename(ele)
 
         # 新增：获取atm_neighbor
-        d['atm_neighbor'] = WidgetUtil.atm_neighbor(ele, soup.find_all())  # 需要所有widgets的上下文
+        d['atm_neighbor'] = WidgetUtil.atm_neighbor(d, state)  # 需要同一界面上其他widgets的上下文
 
         return d
 
@@ -124,7 +153,8 @@ class WidgetUtil:
         return d
 
     @classmethod
-    def find_all_widgets(cls, dom, pkg, act, target_pkg, update_cache=True):
+    def find_all_widgets(cls, state, target_pkg, update_cache=True):
+        pkg, act = state.pkg, state.act
         if 'com.android.launcher' in pkg:
             return []
 
@@ -134,41 +164,40 @@ class WidgetUtil:
         if act.startswith('com.facebook'):
             return []
 
-        gui_signature = WidgetUtil.get_gui_signature(dom, pkg, act)
+        gui_signature = state.get_signature()
         if not update_cache:
             widgets = WidgetUtil.get_all_widgets_from_cache(gui_signature)
             if widgets:
                 return widgets
 
-        soup = BeautifulSoup(dom, 'lxml-xml')
         widgets = []
-        all_widgets = soup.find_all()  # 或者找到所有你需要的元素
-
         for w_class in cls.WIDGET_CLASSES:
-            elements = soup.find_all(attrs={'class': w_class})
+            elements = state.find_all(w_class)
             for e in elements:
-                d = cls.get_widget_from_soup_element(e, all_widgets)
+                d = cls.get_widget_from_element(e, state)
                 if d:
                     if 'yelp' in gui_signature and 'text' in d and d['text'] == 'Sign up with Google':
-                        d['text'] = 'SIGN UP WITH GOOGLE'  # Specific for Yelp
-                    d['package'], d['activity'] = pkg, act
+                        d = d.set('text', 'SIGN UP WITH GOOGLE')  # Specific for Yelp
+                    d = d.update({'package': pkg, 'activity': act})
                     widgets.append(d)
 
         if widgets or update_cache:
-            cls.state_to_widgets[gui_signature] = {'all_widgets': widgets, 'most_similar_widgets': {}}
+            cached = cls.state_to_widgets.peek(gui_signature)  # not a lookup, so not counted in the stats
+            most_similar_widgets = cached['most_similar_widgets'] if cached else {}  # still valid, see version
+            cls.state_to_widgets.put(gui_signature, {'all_widgets': widgets, 'most_similar_widgets': most_similar_widgets})
         return widgets
 
     @classmethod
-    def get_widget_from_soup_element(cls, e, all_widgets):
-        if not e:
+    def get_widget_from_element(cls, e, state):
+        if e is None:
             return None
         d = {}
-        if 'enabled' in e.attrs and e['enabled'] == 'true':
+        if e.get('enabled') == 'true':
             for key in cls.FEATURE_KEYS:
-                d[key] = e.attrs[key] if key in e.attrs else ''
+                d[key] = e.get(key, '')
                 if key == 'class':
-                    d[key] = d[key].split()[0]
-                elif key == 'clickable' and key in e.attrs and e.attrs[key] == 'false':
+                    d[key] = cls.get_class(e)
+                elif key == 'clickable' and e.get(key) == 'false':
                     d[key] = WidgetUtil.propagate_clickable(e)
                 elif key == 'resource-id':
                     rid = d[key].split('/')[-1]
@@ -180,81 +209,120 @@ class WidgetUtil:
             d['sibling_text'] = WidgetUtil.get_sibling_text(e)
             d['filename'] = WidgetUtil.get_filename(e)
 
-            # 使用已经传递的 all_widgets 来计算邻居
-            d['atm_neighbor'] = WidgetUtil.atm_neighbor(d, all_widgets)
+            # 使用所在界面的class索引来计算邻居
+            d['atm_neighbor'] = WidgetUtil.atm_neighbor(d, state)
 
-            return d
+            return cls.add_tokens(Widget.from_dict(d))
         else:
             return None
 
     @staticmethod
-    def get_filename(soup_ele):
+    def get_filename(ele):
         filename = ''
-        if 'filename' in soup_ele.attrs:
-            filename = soup_ele.attrs['filename']
+        if ele.get('filename') is not None:
+            filename = ele.get('filename')
         else:
-            if 'src' in soup_ele.attrs:
-                filename = soup_ele.attrs['src'].split('/')[-1]
-            elif 'href' in soup_ele.attrs:
-                filename = soup_ele.attrs['href'].split('/')[-1]
+            if ele.get('src') is not None:
+                filename = ele.get('src').split('/')[-1]
+            elif ele.get('href') is not None:
+                filename = ele.get('href').split('/')[-1]
         return filename
 
-
     @staticmethod
-    def atm_neighbor(new_widget, all_widgets):
+    def atm_neighbor(new_widget, state):
         """
         计算指定 widget 的 ATM neighbor。
+        class 相同且 resource-id 不同的 widget 即认为是邻居，只保存它们的引用(见 get_neighbor_ref)。
         """
-        neighbors = []
-        for widget in all_widgets:
-            if WidgetUtil.is_neighbor(new_widget, widget):
-                neighbors.append(widget)
-        return neighbors
+        rid = new_widget.get('id-prefix', '') + new_widget.get('resource-id', '')
+        key = (new_widget.get('class'), rid)
+        if key not in state.neighbors:  # widgets with the same class and resource-id share the list
+            neighbors = []
+            for e in state.find_all(key[0]):
+                if e.get('resource-id', '') != rid:
+                    ref = WidgetUtil.get_neighbor_ref(e)
+                    if ref:
+                        neighbors.append(ref)
+            state.neighbors[key] = tuple(neighbors)
+        return state.neighbors[key]
 
     @staticmethod
-    def is_neighbor(widget1, widget2):
-        """
-        判断两个 widget 是否是邻居。
-        假设两个 widget 的 class 相同且 resource-id 不同即认为是邻居。
-        """
-        if widget1.get('class') == widget2.get('class') and widget1.get('resource-id') != widget2.get('resource-id'):
-            return True
-        return False
+    def get_neighbor_ref(ele):
+        """A compact reference to a neighbor: its resource-id name, else its text, else its content-desc"""
+        rid = ele.get('resource-id', '')
+        if rid:
+            return rid.split('/')[-1]
+        return ele.get('text') or ele.get('content-desc') or ''
 
     @classmethod
-    def propagate_clickable(cls, soup_element):
-        parent = soup_element.find_parent()
-        if 'clickable' in parent.attrs and parent['clickable'] == 'true':
+    def propagate_clickable(cls, element):
+        parent = element.getparent()
+        if parent is None:
+            return 'false'
+        if parent.get('clickable') == 'true':
             return 'true'
         for i in range(2):
-            parent = parent.find_parent()
-            if parent and 'class' in parent.attrs and parent['class'][0] in ['android.widget.ListView']:
-                if 'clickable' in parent.attrs and parent['clickable'] == 'true':
-                    return 'true'
+            parent = parent.getparent()
+            if parent is None:
+                break
+            if cls.get_class(parent) in ['android.widget.ListView'] and parent.get('clickable') == 'true':
+                return 'true'
         return 'false'
 
-    @staticmethod
-    def weighted_sim(new_widget, old_widget, use_stopwords=True, cross_check=False):
-        # 包含新的属性在计算相似度时使用
-        attrs = ['resource-id', 'text', 'content-desc', 'parent_text', 'sibling_text', 'filename', 'atm_neighbor']
+    @classmethod
+    def add_tokens(cls, w):
+        """Tokenize the SIM_ATTRS of a Widget once, with and without stopword removal, into w.tokens"""
+        w.tokens = {use_stopwords: cls.tokenize_attrs(w, use_stopwords) for use_stopwords in [True, False]}
+        return w
 
-        is_attr_existed_old = [a in old_widget and old_widget[a] for a in attrs]
-        is_attr_existed_new = [a in new_widget and new_widget[a] for a in attrs]
+    @classmethod
+    def tokenize_attrs(cls, w, use_stopwords=True):
+        tokens = {}
+        for attr in cls.SIM_ATTRS:
+            if attr in w and w[attr]:
+                try:
+                    tokens[attr] = StrUtil.tokenize(attr, w[attr], use_stopwords)
+                except AssertionError:  # nothing left after sanitizing, e.g., 'pkg:id/'
+                    tokens[attr] = []
+                if attr == 'resource-id':
+                    tokens[attr] = StrUtil.expand_text(w.get('class', ''), attr, tokens[attr])
+            else:
+                tokens[attr] = []
+        return tokens
+
+    @classmethod
+    def get_tokens(cls, w, use_stopwords=True):
+        if w.tokens is None:  # e.g., a loaded event, or an update changed the attributes
+            cls.add_tokens(w)
+        return w.tokens[use_stopwords]
+
+    @classmethod
+    def get_sim_pairs(cls, new_widget, old_widget, use_stopwords=True):
+        """Return the (new, old) attribute tokens compared by weighted_sim, or None if the widgets are not comparable"""
+        is_attr_existed_old = [a in old_widget and old_widget[a] for a in cls.SIM_ATTRS]
+        is_attr_existed_new = [a in new_widget and new_widget[a] for a in cls.SIM_ATTRS]
         if not any(is_attr_existed_old) or not any(is_attr_existed_new):
             return None
+        new_tokens = cls.get_tokens(new_widget, use_stopwords)
+        old_tokens = cls.get_tokens(old_widget, use_stopwords)
+        return [(new_tokens[attr], old_tokens[attr]) for attr in cls.SIM_ATTRS if attr in new_widget and attr in old_widget]
 
-        w_scores = []
-        for attr in attrs:
-            if attr in new_widget and attr in old_widget:
-                sim = StrUtil.w2v_sent_sim(new_widget[attr], old_widget[attr])  # 使用自定义的相似度函数
-                if sim is not None:
-                    w_scores.append(sim)
-
+    @staticmethod
+    def average_sim(attr_scores):
+        w_scores = [sim for sim in attr_scores if sim is not None]
         if w_scores:
             return sum(w_scores) / len(w_scores)  # 返回平均相似度
         else:
             return None
 
+    @staticmethod
+    def weighted_sim(new_widget, old_widget, use_stopwords=True, cross_check=False):
+        pairs = WidgetUtil.get_sim_pairs(new_widget, old_widget, use_stopwords)
+        if pairs is None:
+            return None
+        # all attributes of the pair are scored in one round trip
+        return WidgetUtil.average_sim(StrUtil.w2v_sent_sim_batch(pairs))
+
     @classmethod
     def is_equal(cls, w1, w2, ignore_activity=False):
         if not w1 or not w2:
@@ -277,32 +345,20 @@ class WidgetUtil:
         return True
 
     @classmethod
-    def locate_widget(cls, dom, criteria):
-        regex_cria = {}
-        for k, v in criteria.items():
-            if v:
-                v = v.replace('+', r'\+')  # for error when match special char '+'
-                v = v.replace('?', r'\?')  # for error when match special char '?'
-                if k == 'resource-id':
-                    regex_cria[k] = re.compile(f'{v}$')
-                else:
-                    regex_cria[k] = re.compile(f'{v}')
-        if not regex_cria:
+    def locate_widget(cls, state, criteria):
+        """The widget of the first element whose attributes contain the (non-empty) values of the criteria,
+        literally; the resource-id must end with the given one (it may lack the package prefix)
+        """
+        cond = {k: ('ends-with' if k == 'resource-id' else 'contains', v) for k, v in criteria.items() if v}
+        if not cond:
             return None
-        soup = BeautifulSoup(dom, 'lxml-xml')
-
-        # 获取所有widgets
-        all_widgets = soup.find_all()  # 假设你需要获取所有的元素
-
-        # 查找符合条件的widget并传递所有widgets
-        return cls.get_widget_from_soup_element(soup.find(attrs=regex_cria), all_widgets)
+        return cls.get_widget_from_element(state.find(cond), state)
 
-    @classmethod
-    def most_similar(cls, src_event, widgets, use_stopwords=True, expand_btn_to_text=False, cross_check=False):
+    @staticmethod
+    def get_tgt_classes(src_event, expand_btn_to_text=False):
+        """The classes of the target widgets that may be matched to the source event"""
         src_class = src_event['class']
         is_clickable = src_event['clickable']
-        is_password = src_event['password']
-        similars = []
         tgt_classes = [src_class]
         if src_class in ['android.widget.ImageButton', 'android.widget.Button']:
             tgt_classes = ['android.widget.ImageButton', 'android.widget.Button']
@@ -323,34 +379,73 @@ class WidgetUtil:
                 tgt_classes.append('android.widget.TextView')
         elif src_class == 'android.widget.MultiAutoCompleteTextView':
             tgt_classes.append('android.widget.EditText')
+        return tgt_classes
 
-        for w in widgets:
-            need_evaluate = False
-            if w['class'] in tgt_classes:
-                if 'password' in w and w['password'] != is_password:
-                    continue
-                if 'clickable' in w:
-                    if w['clickable'] == is_clickable:
-                        need_evaluate = True
-                    elif 'action' in src_event and 'class' in w:
-                        if src_event['action'][0].startswith('wait_until') \
-                                and w['class'] in ['android.widget.EditText', 'android.widget.TextView']:
-                            need_evaluate = True
-                        elif src_event['action'][0].startswith('swipe') and w['class'] in ['android.widget.TextView']:
-                            need_evaluate = True
-                else:
-                    need_evaluate = True
-            score = WidgetUtil.weighted_sim(w, src_event, use_stopwords, cross_check) if need_evaluate else None
+    @staticmethod
+    def get_any_clickable_classes(src_event):
+        """The target classes whose clickable flag need not be the same as that of the source event"""
+        if 'action' not in src_event:
+            return []
+        if src_event['action'][0].startswith('wait_until'):
+            return ['android.widget.EditText', 'android.widget.TextView']
+        elif src_event['action'][0].startswith('swipe'):
+            return ['android.widget.TextView']
+        return []
+
+    @classmethod
+    def most_similar(cls, src_event, widget_db, use_stopwords=True, expand_btn_to_text=False, cross_check=False,
+                     top_k=None, gui_signature=None):
+        """The compatible widgets in widget_db (a WidgetDB) and their scores, the most similar first.
+        Only the top_k of them are returned if top_k is given.
+        With gui_signature, the ranking is cached for that gui state until widget_db changes
+        """
+        if gui_signature is not None:
+            ranking_key = cls.get_ranking_key(src_event, use_stopwords, expand_btn_to_text, cross_check, top_k)
+            similars = cls.get_most_similar_widgets_from_cache(gui_signature, ranking_key, widget_db.version)
+            if similars is None:
+                similars = cls.most_similar(src_event, widget_db, use_stopwords, expand_btn_to_text, cross_check, top_k)
+                cls.put_most_similar_widgets_to_cache(gui_signature, ranking_key, widget_db.version, similars)
+            return similars
+        candidates = widget_db.get_candidates(cls.get_tgt_classes(src_event, expand_btn_to_text),
+                                              src_event['clickable'], src_event['password'],
+                                              cls.get_any_clickable_classes(src_event))
+        index = widget_db.embedding_index
+        if index is not None and index.use_stopwords == use_stopwords:
+            # vectorized: the source event against all widgets at once
+            scores = index.score(cls.get_tokens(src_event, use_stopwords))
+            similars = [(w, scores[signature]) for signature, w in candidates if scores[signature]]
+        else:
+            similars = cls.score_candidates(src_event, [w for _, w in candidates], use_stopwords)
+        if top_k is not None:
+            return heapq.nlargest(top_k, similars, key=lambda x: x[1])
+        similars.sort(key=lambda x: x[1], reverse=True)
+        return similars
+
+    @classmethod
+    def score_candidates(cls, src_event, candidates, use_stopwords=True):
+        """weighted_sim of each candidate widget, with one batch query; only the widgets with a score are kept"""
+        to_score = []  # (widget, attribute pairs to be scored)
+        for w in candidates:
+            pairs = WidgetUtil.get_sim_pairs(w, src_event, use_stopwords)
+            if pairs:
+                to_score.append((w, pairs))
+
+        # score all candidates with one batch query instead of one query per attribute per widget
+        all_pairs = [p for _, pairs in to_score for p in pairs]
+        all_scores = StrUtil.w2v_sent_sim_batch(all_pairs) if all_pairs else []
+        similars = []
+        start = 0
+        for w, pairs in to_score:
+            score = WidgetUtil.average_sim(all_scores[start:start + len(pairs)])
+            start += len(pairs)
             if score:
                 similars.append((w, score))
-        similars.sort(key=lambda x: x[1], reverse=True)
         return similars
 
     @classmethod
-    def get_nearest_button(cls, dom, w):
-        soup = BeautifulSoup(dom, 'lxml-xml')
+    def get_nearest_button(cls, state, w):
         for btn_class in ['android.widget.ImageButton', 'android.widget.Button', 'android.widget.EditText']:
-            all_btns = soup.find_all(attrs={'class': btn_class})
-            if all_btns and len(all_btns) > 0:
-                return cls.get_widget_from_soup_element(all_btns[0])
+            all_btns = state.find_all(btn_class)
+            if all_btns:
+                return cls.get_widget_from_element(all_btns[0], state)
         return None
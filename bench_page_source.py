@@ -0,0 +1,75 @@
+"""Latency of the page source backends of Runner on test_repo apps: appium's driver.page_source vs. uiautomator dump
+over a persistent adb shell (HierarchyDump.py).
+
+    python bench_page_source.py APP_IDS [N_DUMPS] [APPIUM_PORT] [EMULATOR]
+
+APP_IDS is a comma separated list of app ids of test_repo, e.g., a21,a22. Each app is launched (without clearing its
+data) and its first screen is fetched N_DUMPS times (10 by default) with each backend. Besides the latency, the number
+of elements of each class the widget queries look at (WidgetUtil.WIDGET_CLASSES) is compared between the two sources
+"""
+import os
+import sys
+import time
+from csv import DictReader
+from statistics import median
+
+# local import
+from const import TEST_REPO
+from Runner import Runner
+from GuiState import GuiState
+from WidgetUtil import WidgetUtil
+from HierarchyDump import AdbHierarchyDump
+
+
+def get_app_info(aid):
+    folder = aid[:2]  # e.g., a2
+    with open(os.path.join(TEST_REPO, folder, folder + '.config'), newline='') as cf:
+        for row in DictReader(cf):  # aid,package,activity
+            if row['aid'] == aid:
+                return row['package'], row['activity']
+    assert False, f'Unknown app id: {aid}'
+
+
+def time_it(fetch, n):
+    latencies = []
+    page_source = None
+    for _ in range(n):
+        t_start = time.time()
+        page_source = fetch()
+        latencies.append(time.time() - t_start)
+    latencies.sort()
+    return latencies, page_source
+
+
+def count_widgets(page_source):
+    state = GuiState(page_source, '', '')
+    return {c: len(state.find_all(c)) for c in WidgetUtil.WIDGET_CLASSES}
+
+
+def bench(aids, n=10, appium_port='4723', udid=None):
+    for aid in aids:
+        pkg, act = get_app_info(aid)
+        runner = Runner(pkg, act, True, appium_port, udid)
+        runner.perform_actions([], reset=True)  # launch the app and let it settle
+        dump = AdbHierarchyDump(udid)
+        results = {'appium': time_it(lambda: runner.driver.page_source, n),
+                   'adb_dump': time_it(dump.get_page_source, n)}
+        for backend, (latencies, page_source) in results.items():
+            print(f'{aid} {backend}: p50 {median(latencies) * 1000:.1f} ms, '
+                  f'p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.1f} ms, '
+                  f'{len(page_source or "")} chars')
+        sources = [page_source for _, page_source in results.values()]
+        if all(sources):
+            counts = [count_widgets(s) for s in sources]
+            print(f'{aid} widgets: ' + ('same' if counts[0] == counts[1] else f'appium {counts[0]}, adb_dump {counts[1]}'))
+        else:
+            print(f'{aid} adb_dump failed')
+        dump.close()
+        runner.driver.quit()
+
+
+if __name__ == '__main__':
+    bench(sys.argv[1].split(','),
+          int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+          sys.argv[3] if len(sys.argv) > 3 else '4723',
+          sys.argv[4] if len(sys.argv) > 4 else None)
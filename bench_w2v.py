@@ -0,0 +1,71 @@
+"""Throughput of the w2v service with N concurrent clients, e.g., several Explorer processes sharing one service.
+
+    python bench_w2v.py [N_CLIENTS] [SECONDS] [URL] [BATCH_SIZE]
+
+Each client is a thread with its own keep-alive session that sends batch queries of BATCH_SIZE sentence pairs,
+built from the attributes of the test_repo base tests, until the time is up.
+The service counters are reset before the run and printed after it (GET/DELETE /stats)
+"""
+import sys
+import time
+import json
+import random
+import threading
+from statistics import median
+import requests
+
+# local import
+from const import W2V_URL
+from w2v_service import collect_test_repo_sentences
+
+BATCH_SIZE = 50
+
+
+def get_pairs():
+    pairs = []
+    for sent_set in collect_test_repo_sentences().values():
+        sents = [list(s) for s in sent_set]
+        pairs += [[s_new, s_old] for s_new in sents for s_old in sents]
+    return pairs
+
+
+def client(url, pairs, t_end, results, batch_size=BATCH_SIZE):
+    session = requests.Session()
+    latencies, n_pairs, n_busy = [], 0, 0
+    while time.time() < t_end:
+        batch = random.sample(pairs, min(batch_size, len(pairs)))
+        t_start = time.time()
+        resp = session.post(url, headers={'Content-Type': 'application/json'}, data=json.dumps({'pairs': batch}))
+        latencies.append(time.time() - t_start)
+        if resp.status_code == 503:
+            n_busy += 1
+        else:
+            n_pairs += len(batch)
+    results.append((latencies, n_pairs, n_busy))
+
+
+def bench(n_clients=4, seconds=10, url=W2V_URL, batch_size=BATCH_SIZE):
+    pairs = get_pairs()
+    stats_url = url.rsplit('/', 1)[0] + '/stats'
+    requests.delete(stats_url)
+    results = []
+    t_end = time.time() + seconds
+    threads = [threading.Thread(target=client, args=(url, pairs, t_end, results, batch_size)) for _ in range(n_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies = sorted(l for r in results for l in r[0])
+    n_pairs = sum(r[1] for r in results)
+    n_busy = sum(r[2] for r in results)
+    print(f'{n_clients} clients, {seconds}s: {len(latencies) / seconds:.1f} requests/s, {n_pairs / seconds:.1f} pairs/s, '
+          f'latency p50 {median(latencies) * 1000:.1f} ms, p95 {latencies[int(0.95 * (len(latencies) - 1))] * 1000:.1f} ms, '
+          f'{n_busy} rejected (503)')
+    print('Service stats:', requests.get(stats_url).json())
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 4,
+          int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+          sys.argv[3] if len(sys.argv) > 3 else W2V_URL,
+          int(sys.argv[4]) if len(sys.argv) > 4 else BATCH_SIZE)
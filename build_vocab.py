@@ -0,0 +1,118 @@
+"""Build a domain-pruned w2v model that only keeps the vectors of the words CraftDroid can compare.
+
+The token universe is collected from the events in test_repo, the strings and layout widgets extracted by
+ResourceParser from sa_info, and an optional extra word list (one word per line). The reduced KeyedVectors
+is a few MB instead of a few GB, and w2v_service.py can load it instead of the full GoogleNews model:
+
+    python build_vocab.py [OUTPUT_KV] [EXTRA_WORDS_TXT]
+    python w2v_service.py serve OUTPUT_KV
+
+The tokens missing from the full model are reported in OUTPUT_KV.oov.txt
+"""
+import os
+import sys
+import json
+import numpy as np
+from gensim.models import KeyedVectors
+
+# local import
+from StrUtil import StrUtil
+from ResourceParser import ResourceParser
+from const import TEST_REPO, SA_INFO_FOLDER
+import w2v_service
+
+TEXT_ATTRS = ['resource-id', 'text', 'content-desc', 'parent_text', 'sibling_text']
+DEFAULT_OUTPUT = 'craftdroid-vectors.kv'
+
+
+def tokenize_all(s_type, s):
+    """Tokens of s in every form the explorer may query: with/without stopwords, expanded ids, and case variants"""
+    tokens = set()
+    for use_stopwords in [True, False]:
+        try:
+            tokens.update(StrUtil.tokenize(s_type, s, use_stopwords))
+        except AssertionError:  # nothing left after sanitizing, e.g., 'pkg:id/'
+            return set()
+    for expand in StrUtil.EXPAND.values():
+        for t in list(tokens):
+            tokens.update(expand.get(t, []))
+    variants = set()
+    for t in tokens:
+        variants.update([t, t.lower(), t.capitalize()])
+    return variants
+
+
+def collect_from_events():
+    tokens = set()
+    for root, _, files in os.walk(TEST_REPO):
+        for fname in files:
+            if not fname.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(root, fname), 'r', encoding='utf-8') as f:
+                    events = json.load(f)
+            except ValueError as excep:
+                print(f'Skip {os.path.join(root, fname)}: {excep}')
+                continue
+            for e in events:
+                for attr in TEXT_ATTRS:
+                    if attr in e and isinstance(e[attr], str):
+                        tokens |= tokenize_all(attr, e[attr])
+                if e.get('activity'):
+                    tokens |= tokenize_all('Activity', e['activity'])
+                if 'action' in e and len(e['action']) > 1 and 'send_keys' in e['action'][0]:
+                    tokens |= tokenize_all('text', str(e['action'][1]))
+    return tokens
+
+
+def collect_from_sa_info():
+    tokens = set()
+    if not os.path.exists(SA_INFO_FOLDER):
+        return tokens
+    for aid in sorted(os.listdir(SA_INFO_FOLDER)):
+        try:
+            rp = ResourceParser(os.path.join(SA_INFO_FOLDER, aid))
+        except Exception as excep:
+            print(f'Skip {aid}: {excep}')
+            continue
+        for text, _ in rp.sName_to_info.values():
+            tokens |= tokenize_all('text', text)
+        for w in rp.get_widgets():
+            for attr in TEXT_ATTRS:
+                if attr in w:
+                    tokens |= tokenize_all(attr, w[attr])
+    return tokens
+
+
+def collect_from_word_list(fpath):
+    tokens = set()
+    with open(fpath, 'r', encoding='utf-8') as f:
+        for line in f:
+            tokens |= tokenize_all('text', line)
+    return tokens
+
+
+def build(output_path=DEFAULT_OUTPUT, extra_words=None):
+    tokens = collect_from_events() | collect_from_sa_info()
+    if extra_words:
+        tokens |= collect_from_word_list(extra_words)
+    print(f'{len(tokens)} distinct tokens collected')
+
+    full_model = w2v_service.load_model()
+    in_vocab = sorted(t for t in tokens if t in full_model.key_to_index)
+    oov = sorted(t for t in tokens if t not in full_model.key_to_index)
+
+    pruned = KeyedVectors(full_model.vector_size)
+    pruned.add_vectors(in_vocab, np.array([full_model.get_vector(t) for t in in_vocab], dtype=np.float32))
+    pruned.fill_norms()
+    pruned.save(output_path, ignore=())
+
+    oov_path = output_path + '.oov.txt'
+    with open(oov_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(oov))
+    print(f'Saved {len(in_vocab)} vectors to {output_path}')
+    print(f'{len(oov)} tokens ({len(oov) / max(len(tokens), 1):.1%}) not in vocabulary, listed in {oov_path}')
+
+
+if __name__ == '__main__':
+    build(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_OUTPUT, sys.argv[2] if len(sys.argv) > 2 else None)
@@ -3,6 +3,46 @@ CONFIG_FILE = 'config.csv'
 SA_INFO_FOLDER = 'sa_info'
 LOG_FOLDER = 'log'
 SNAPSHOT_FOLDER = 'snapshot'
+# similarity backend: 'http' queries w2v_service.py; 'local' loads the w2v model in the Explorer process
+SIM_BACKEND = 'http'
+W2V_URL = 'http://127.0.0.1:5000/w2v'
+W2V_TIMEOUT = (3, 60)  # seconds to connect and to wait for the scores
+W2V_RETRIES = 3  # retries on connection errors and read timeouts, with exponential backoff
+# retries on 502/503/504 responses (e.g., the service is busy), after its Retry-After or the backoff; failed queries
+# score None, as a failed pair did before
+W2V_BUSY_RETRIES = 10
+SIM_MEMO_SIZE = 100000  # similarity scores memoized in the Explorer process (LRU)
+# KeyedVectors loaded by the 'local' backend instead of the GoogleNews model, e.g., the output of build_vocab.py
+W2V_MODEL_PATH = ''
+# widgets cached per GUI state (WidgetUtil.state_to_widgets): at most this many states and about this many bytes
+STATE_CACHE_MAX_ENTRIES = 1000
+STATE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# score a source event against the whole widget_db with NumPy (EmbeddingIndex); needs SIM_BACKEND = 'local'
+SIM_VECTORIZED = False
+# waiting for the UI around actions (Runner.wait_for_idle): 'adaptive' polls the page source until it has not changed
+# for UI_WAIT_STABLE seconds, at least UI_WAIT_MIN seconds and at most the fixed wait; 'fixed' always sleeps the fixed
+# wait. 'adaptive' is opt-in until it has been checked on more apps: a screen about to change (e.g., a splash screen)
+# that looks stable makes the next action miss its element
+UI_WAIT = 'fixed'
+UI_WAIT_MIN = 0.3
+UI_WAIT_POLL = 0.25  # seconds between two polls
+UI_WAIT_STABLE = 1.0  # seconds without any change in the polled page sources
+# emulator snapshots of the device after a prefix of target events ran (SnapshotCache.py); a later replay of the same
+# or a longer prefix loads the snapshot instead of starting from the app launch. Emulators only
+PREFIX_SNAPSHOT = False
+PREFIX_SNAPSHOT_MIN_EVENTS = 3  # shorter prefixes are replayed, which is about as fast as loading a snapshot
+PREFIX_SNAPSHOT_MAX_BYTES = 8 * 1024 * 1024 * 1024  # disk budget; least recently used snapshots are deleted first
+# size counted for a snapshot whose folder is not found on this host (e.g., a custom emulator home or a remote
+# emulator), so that the budget still holds; about the RAM image of an emulator, its largest part
+PREFIX_SNAPSHOT_EST_BYTES = 2 * 1024 * 1024 * 1024
+PREFIX_SNAPSHOT_TIMEOUT = 120  # seconds for an adb emu avd snapshot command
+# continue from the current GUI state instead of resetting the app and replaying all target events, when the device
+# has run a prefix of them since the last reset and still shows the screen seen right after (Runner.get_resume_point)
+INCREMENTAL_EXECUTION = False
+# where Runner gets page sources: 'appium' (driver.page_source) or 'adb_dump' (uiautomator dump over a persistent
+# adb shell, normalized to the appium schema; see HierarchyDump.py and bench_page_source.py)
+PAGE_SOURCE_BACKEND = 'appium'
+PAGE_SOURCE_DUMP_TIMEOUT = 10  # seconds for one dump, then appium's page_source is used instead
 # preference for staying at current state
 # SAFE VALUE: 0.037 (a21-a23-b21) <= threshold <= 0.045 (a52-a55-b51)
 # EXTRA_SCORE = 0.037
@@ -1,11 +1,18 @@
 from flask import Flask, request
 from flask_restful import Api, Resource
 import os
+import sys
+import time
+import atexit
+import threading
+from collections import defaultdict, deque
+from itertools import islice
 import gensim
-import pickle
-from nltk import word_tokenize
 import numpy as np
 
+# local import
+from SimCache import SimCache, SingleFlight
+
 # 手动指定training dataset路径
 training_dataset = 'googleplay.txt'
 
@@ -15,39 +22,198 @@ def load_trainingset(file_path):
         data = file.readlines()
     return [line.strip() for line in data]
 
-# 加载 Word2Vec 模型
 model_path_w2v = os.path.join(os.getcwd(), 'GoogleNews-vectors-negative300.bin')
-model_w2v = gensim.models.KeyedVectors.load_word2vec_format(model_path_w2v, binary=True)
+# the same vectors in gensim's native format, created by `python w2v_service.py convert`;
+# memory-mapped read-only, so startup takes seconds and all service processes share one copy in the page cache
+model_path_kv = os.path.join(os.getcwd(), 'GoogleNews-vectors-negative300.kv')
+model_w2v = None
 
 # 缓存相似度计算结果
-cached_sim = dict()
-pkl_path = "./w2v_sim_cache.pkl"
+sim_cache = None
+cache_db_path = "./w2v_sim_cache.db"
+pkl_path = "./w2v_sim_cache.pkl"  # legacy cache file, imported into cache_db_path once
+SENT_SEP = '\x1f'  # joins the words of a sentence into a cache key
+id_sim_cache = {}  # the same scores keyed by the interned token ids, see w2v_sent_sim_ids()
 
-if os.path.exists(pkl_path):
-    with open(pkl_path, 'rb') as f:
-        cached_sim = pickle.load(f)
+# tokens are interned to integer ids once, so scoring works on ints instead of strings
+token_ids = {}  # token -> id
+tokens_by_id = []  # id -> token
+token_vocab_idx = []  # id -> row of the token in model_w2v.vectors, -1 if out of vocabulary
+token_lower_id = []  # id -> id of the lowercased token
+intern_lock = threading.RLock()
 
 # 训练集数据
-training_data = load_trainingset(training_dataset)
+training_data = []
+
+# serving mode (python w2v_service.py serve): worker threads per process and backpressure
+serve_threads = 8
+# requests scored at the same time by one process; the others wait for a slot. Below serve_threads, so that
+# requests queue here (and not only in the server) and the wait for a slot is bounded by busy_timeout
+max_in_flight = 2
+# seconds a request waits for a slot before it is rejected with 503. A ranking of Explorer is one request of often
+# thousands of pairs (seconds to score), so this is well above that and below the read timeout of the clients
+# (W2V_TIMEOUT): requests queue as without the limit, and only a service that is stuck or far behind rejects them
+busy_timeout = 30
+in_flight = None
+single_flight = SingleFlight()  # identical sentence pairs being scored by concurrent requests are computed once
+
+
+class ServiceStats:
+    """Counters of this service process, served by GET /stats and reset by DELETE /stats"""
+    MAX_LATENCIES = 10000  # latencies of the most recent requests kept for the percentiles
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.requests = 0
+            self.rejected = 0
+            self.pairs = 0
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.tokens = 0
+            self.oov_tokens = 0
+            self.latencies = deque(maxlen=ServiceStats.MAX_LATENCIES)
+            self.merged_at_reset = single_flight.merged
+
+    def record_request(self, num_pairs, seconds):
+        with self.lock:
+            self.requests += 1
+            self.pairs += num_pairs
+            self.latencies.append(seconds)
+
+    def record_rejected(self):
+        with self.lock:
+            self.rejected += 1
+
+    def record_cache(self, is_hit):
+        with self.lock:
+            if is_hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+
+    def record_tokens(self, ids):
+        with self.lock:
+            self.tokens += len(ids)
+            self.oov_tokens += sum(1 for i in ids if token_vocab_idx[i] < 0)
+
+    @staticmethod
+    def percentile(sorted_values, p):
+        if not sorted_values:
+            return None
+        return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+    def get(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                'pid': os.getpid(),
+                'uptime_seconds': time.time() - self.started,
+                'requests': self.requests,
+                'rejected_busy': self.rejected,
+                'pairs_scored': self.pairs,
+                'cache_hits': self.cache_hits,
+                'cache_misses': self.cache_misses,
+                'cache_hit_ratio': self.cache_hits / lookups if lookups else None,
+                'merged_in_flight': single_flight.merged - self.merged_at_reset,
+                'tokens': self.tokens,
+                'oov_rate': self.oov_tokens / self.tokens if self.tokens else None,
+                'cache_entries': len(id_sim_cache) + (len(sim_cache) if sim_cache else 0),
+                'cache_bytes': get_cache_bytes(),
+                'interned_tokens': len(tokens_by_id),
+                'latency_ms': {f'p{p}': ServiceStats.percentile(latencies, p) * 1000 if latencies else None
+                               for p in [50, 95, 99]},
+            }
+
+
+stats = ServiceStats()
+
+def init(model_path=None, shared_cache=False):
+    """Load the model and the similarity cache. Called once by the Flask service,
+    or by SimBackend.LocalSimBackend when the scoring runs inside the Explorer process.
+    model_path: a KeyedVectors file to use instead of the GoogleNews model, e.g., the one from build_vocab.py
+    shared_cache: the cache file is shared by several service processes
+    """
+    global model_w2v, sim_cache, training_data
+    if model_w2v is not None:
+        return
+    # 加载 Word2Vec 模型
+    model_w2v = load_model(model_path)
+    if model_w2v.norms is None:
+        model_w2v.fill_norms()  # unit vectors for the kernel in w2v_sim_matrix
+    is_new_cache = not os.path.exists(cache_db_path)
+    sim_cache = SimCache(cache_db_path, shared=shared_cache)
+    if is_new_cache:
+        sim_cache.import_pickle(pkl_path)
+    atexit.register(sim_cache.close)
+    if os.path.exists(training_dataset):
+        training_data = load_trainingset(training_dataset)
+
+def load_model(model_path=None):
+    if model_path:
+        return gensim.models.KeyedVectors.load(model_path, mmap='r')
+    if os.path.exists(model_path_kv):
+        return gensim.models.KeyedVectors.load(model_path_kv, mmap='r')
+    print(f'{model_path_kv} not found; loading {model_path_w2v} into memory. '
+          f'Run `python w2v_service.py convert` once for a fast, memory-mapped startup')
+    return gensim.models.KeyedVectors.load_word2vec_format(model_path_w2v, binary=True)
+
+def convert_model(src_path=model_path_w2v, dst_path=model_path_kv):
+    """One-time conversion of the word2vec binary into gensim's native format.
+    The vector matrix (and its norms) are stored as separate .npy files that can be memory-mapped
+    """
+    model = gensim.models.KeyedVectors.load_word2vec_format(src_path, binary=True)
+    model.fill_norms()
+    model.save(dst_path, ignore=())  # keep the precomputed norms
+    print(f'Saved {len(model.key_to_index)} vectors to {dst_path}')
+
+def intern_tokens(tokens):
+    """Return the ids of the tokens, adding the new tokens to the interned vocabulary"""
+    ids = []
+    for token in tokens:
+        tid = token_ids.get(token)
+        ids.append(tid if tid is not None else add_token(token))
+    return ids
+
+def add_token(token):
+    with intern_lock:
+        if token in token_ids:
+            return token_ids[token]
+        lower = token.lower()
+        lower_id = add_token(lower) if lower != token else len(tokens_by_id)
+        tid = len(tokens_by_id)
+        tokens_by_id.append(token)
+        token_vocab_idx.append(model_w2v.key_to_index.get(token, -1))
+        token_lower_id.append(lower_id)
+        token_ids[token] = tid
+        return tid
+
+def get_tokens(s):
+    # the client sends tokenized and normalized words (StrUtil.tokenize); a plain string is split on whitespace
+    return s.split() if isinstance(s, str) else s
 
 def w2v_sim(w_from, w_to):
-    if (w_from, w_to) in cached_sim:
-        return cached_sim[(w_from, w_to)]
-    elif (w_to, w_from) in cached_sim:
-        return cached_sim[(w_to, w_from)]
-    else:
-        if w_from.lower() == w_to.lower():
-            sim = 1.0
-        elif w_from in model_w2v.key_to_index and w_to in model_w2v.key_to_index:
-            sim = 1 / (1 + model_w2v.wmdistance(word_tokenize(w_from), word_tokenize(w_to)))
-        else:
-            sim = None
-        cached_sim[(w_from, w_to)] = sim
-        with open(pkl_path, 'wb') as f:
-            pickle.dump(cached_sim, f)
+    sim = sim_cache.get(w_from, w_to)
+    if sim is not SimCache.MISSING:
         return sim
+    if w_from.lower() == w_to.lower():
+        sim = 1.0
+    elif w_from in model_w2v.key_to_index and w_to in model_w2v.key_to_index:
+        sim = 1 / (1 + model_w2v.wmdistance([w_from], [w_to]))
+    else:
+        sim = None
+    sim_cache.put(w_from, w_to, sim)
+    return sim
 
-def w2v_sent_sim(s_new, s_old):
+def w2v_sent_sim_pairwise(s_new, s_old):
+    """Reference implementation of w2v_sent_sim: one wmdistance per word pair and a greedy matching in Python.
+    Kept to check the vectorized kernel (python w2v_service.py check-kernel)
+    """
     scores = []
     valid_new_words = set()
     valid_old_words = set(s_old)
@@ -68,14 +234,164 @@ def w2v_sent_sim(s_new, s_old):
             break
     return sum(counted) / len(counted) if counted else None
 
+def w2v_sim_matrix(ids_new, ids_old):
+    """|ids_new| x |ids_old| word similarities computed with one matrix product; NaN marks a pair without score.
+
+    For two single in-vocabulary words, wmdistance is the euclidean distance d between their unit vectors,
+    so 1 / (1 + d) is computed from the cosine as d = sqrt(2 - 2 * cos). This matches w2v_sim up to float
+    rounding (< 1e-6).
+    """
+    is_equal = np.array([token_lower_id[i] for i in ids_new])[:, None] == \
+        np.array([token_lower_id[i] for i in ids_old])[None, :]
+    idx_new = np.array([token_vocab_idx[i] for i in ids_new])
+    idx_old = np.array([token_vocab_idx[i] for i in ids_old])
+    in_vocab = (idx_new >= 0)[:, None] & (idx_old >= 0)[None, :]
+
+    sims = np.full((len(ids_new), len(ids_old)), np.nan)
+    if in_vocab.any():
+        v_new = unit_vectors(idx_new)
+        v_old = unit_vectors(idx_old)
+        dist = np.sqrt(np.clip(2 - 2 * (v_new @ v_old.T), 0, None))
+        sims = np.where(in_vocab, 1 / (1 + dist), sims)
+    return np.where(is_equal, 1.0, sims)
+
+def unit_vectors(indices):
+    vectors = np.zeros((len(indices), model_w2v.vector_size))
+    valid = indices >= 0
+    vectors[valid] = model_w2v.vectors[indices[valid]] / model_w2v.norms[indices[valid]][:, None]
+    return vectors
+
+def greedy_match(sims):
+    """Greedy one-to-one matching of the highest scores in the similarity matrix; return the mean matched score"""
+    sims = np.where(np.isnan(sims), -np.inf, sims)
+    counted = []
+    for _ in range(min(sims.shape)):
+        i, j = np.unravel_index(np.argmax(sims), sims.shape)
+        if sims[i, j] == -np.inf:
+            break
+        counted.append(sims[i, j])
+        sims[i, :] = -np.inf
+        sims[:, j] = -np.inf
+    return float(np.mean(counted)) if counted else None
+
+def w2v_sent_sim(s_new, s_old):
+    ids_new, ids_old = intern_tokens(get_tokens(s_new)), intern_tokens(get_tokens(s_old))
+    stats.record_tokens(ids_new + ids_old)
+    return w2v_sent_sim_ids(ids_new, ids_old)
+
+def w2v_sent_sim_ids(ids_new, ids_old):
+    # duplicated words do not change the one-to-one matching
+    ids_new = list(dict.fromkeys(ids_new))
+    ids_old = list(dict.fromkeys(ids_old))
+    if not ids_new or not ids_old:
+        return None
+    key = SimCache.get_key(tuple(sorted(ids_new)), tuple(sorted(ids_old)))
+    sim = id_sim_cache.get(key, SimCache.MISSING)
+    if sim is SimCache.MISSING:
+        sim = single_flight.do(key, lambda: compute_sent_sim(ids_new, ids_old, key))
+    else:
+        stats.record_cache(is_hit=True)
+    return sim
+
+def compute_sent_sim(ids_new, ids_old, key):
+    # the persistent cache is keyed by the words, because the ids only live as long as the process;
+    # for two single words it is the same entry as w2v_sim(w_new, w_old)
+    key_new = SENT_SEP.join(sorted(tokens_by_id[i] for i in ids_new))
+    key_old = SENT_SEP.join(sorted(tokens_by_id[i] for i in ids_old))
+    sim = sim_cache.get(key_new, key_old)
+    stats.record_cache(is_hit=sim is not SimCache.MISSING)
+    if sim is SimCache.MISSING:
+        sim = greedy_match(w2v_sim_matrix(ids_new, ids_old))
+        sim_cache.put(key_new, key_old, sim)
+    id_sim_cache[key] = sim
+    return sim
+
+def get_cache_bytes(sample_size=100):
+    """Approximate memory of the in-memory caches: dict tables plus the average size of a sampled entry"""
+    total = 0
+    for cache in [id_sim_cache, sim_cache.mem if sim_cache else {}]:
+        total += sys.getsizeof(cache)
+        try:
+            sample = list(islice(cache, sample_size))
+        except RuntimeError:  # resized by a concurrent request
+            sample = []
+        if sample:
+            entry_bytes = sum(sys.getsizeof(k) + sum(sys.getsizeof(part) for part in k) + 24 for k in sample)
+            total += entry_bytes * len(cache) // len(sample)
+    return total
+
+def w2v_sent_sim_batch(pairs):
+    # pairs: [[s_new, s_old], ...]; the scores are returned in the same order
+    # every distinct token of the request is interned once
+    request_ids = {}
+    for s_new, s_old in pairs:
+        for token in get_tokens(s_new) + get_tokens(s_old):
+            if token not in request_ids:
+                request_ids[token] = intern_tokens([token])[0]
+            stats.record_tokens([request_ids[token]])
+    return [w2v_sent_sim_ids([request_ids[t] for t in get_tokens(s_new)], [request_ids[t] for t in get_tokens(s_old)])
+            for s_new, s_old in pairs]
+
+def collect_test_repo_sentences():
+    """Tokenized attribute values of the test_repo base tests, grouped by (function folder, attribute)"""
+    import json
+    from StrUtil import StrUtil
+    from const import TEST_REPO
+    sents = defaultdict(set)
+    for root, _, files in os.walk(TEST_REPO):
+        if os.path.basename(root) != 'base':
+            continue
+        for fname in files:
+            with open(os.path.join(root, fname), 'r', encoding='utf-8') as f:
+                for e in json.load(f):
+                    for attr in ['resource-id', 'text', 'content-desc', 'parent_text', 'sibling_text']:
+                        if e.get(attr):
+                            sents[(root, attr)].add(tuple(StrUtil.tokenize(attr, e[attr])))
+    return sents
+
+def check_kernel(tolerance=1e-6):
+    """Compare w2v_sent_sim with the pairwise reference on the attribute pairs of the test_repo base tests,
+    i.e., every attribute of an event against the same attribute of every event for the same function in other apps
+    """
+    n_pairs, n_mismatch, max_diff = 0, 0, 0.0
+    for sent_set in collect_test_repo_sentences().values():
+        for s_new in sent_set:
+            for s_old in sent_set:
+                expected = w2v_sent_sim_pairwise(s_new, s_old)
+                actual = greedy_match(w2v_sim_matrix(list(dict.fromkeys(intern_tokens(s_new))),
+                                                     list(dict.fromkeys(intern_tokens(s_old)))))
+                n_pairs += 1
+                if (expected is None) != (actual is None):
+                    n_mismatch += 1
+                elif expected is not None:
+                    max_diff = max(max_diff, abs(expected - actual))
+                    if abs(expected - actual) > tolerance:
+                        n_mismatch += 1
+                        print(f'{s_new} vs {s_old}: {expected} (pairwise) != {actual} (kernel)')
+    print(f'{n_pairs} pairs checked, {n_mismatch} beyond tolerance {tolerance}, max abs difference {max_diff}')
+
 class WordSim(Resource):
     def get(self):
         return {'error': 'Non-supported HTTP Method'}, 200
 
     def post(self):
-        args = request.json
-        sent_sim = w2v_sent_sim(args['s_new'], args['s_old'])
-        return {'sent_sim': sent_sim}, 200
+        t_start = time.time()
+        if not in_flight.acquire(timeout=busy_timeout):
+            stats.record_rejected()
+            return {'error': 'Service busy, retry later'}, 503, {'Retry-After': '1'}
+        try:
+            args = request.json
+            if 'pairs' in args:
+                # batch query, e.g., {'pairs': [[['add'], ['new', 'task']], [['save'], ['done']]]}
+                sent_sims = w2v_sent_sim_batch(args['pairs'])
+                stats.record_request(len(args['pairs']), time.time() - t_start)
+                return {'sent_sims': sent_sims}, 200
+            sent_sim = w2v_sent_sim(args['s_new'], args['s_old'])
+            stats.record_request(1, time.time() - t_start)
+            return {'sent_sim': sent_sim}, 200
+        finally:
+            in_flight.release()
+            sim_cache.commit()  # one commit per request; keeps the write lock short when processes share the cache
 
 
     def put(self):
@@ -84,8 +400,45 @@ class WordSim(Resource):
     def delete(self):
         return {'error': 'Non-supported HTTP Method'}, 200
 
-if __name__ == '__main__':
+class Stats(Resource):
+    def get(self):
+        return stats.get(), 200
+
+    def delete(self):
+        # reset the counters, e.g., between benchmark runs; the caches are kept
+        stats.reset()
+        return stats.get(), 200
+
+def create_app(model_path=None, shared_cache=False):
+    """WSGI application factory, also for multi-process servers, e.g.,
+    gunicorn -w 4 -b 127.0.0.1:5000 "w2v_service:create_app(shared_cache=True)"
+    Every worker memory-maps the same model file, so the vectors are in memory once
+    """
+    global in_flight
+    init(model_path, shared_cache)
+    in_flight = threading.BoundedSemaphore(max_in_flight)
     app = Flask(__name__)
     api = Api(app)
     api.add_resource(WordSim, '/w2v')
-    app.run(debug=True)
+    api.add_resource(Stats, '/stats')
+    return app
+
+if __name__ == '__main__':
+    # python w2v_service.py                    -> start the development server
+    # python w2v_service.py serve [MODEL_KV]   -> start a multi-threaded waitress server, optionally with another
+    #                                             model, e.g., from build_vocab.py
+    # python w2v_service.py convert [SRC DST]  -> convert the word2vec binary for memory-mapped loading
+    # python w2v_service.py check-kernel [MODEL_KV] -> compare the vectorized scores with the pairwise ones
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert':
+        convert_model(*sys.argv[2:4])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'check-kernel':
+        init(sys.argv[2] if len(sys.argv) > 2 else None)
+        check_kernel()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from waitress import serve
+        serve(create_app(sys.argv[2] if len(sys.argv) > 2 else None), host='127.0.0.1', port=5000,
+              threads=serve_threads)
+    else:
+        create_app().run(debug=True)